@@ -1,14 +1,26 @@
 import os
+import re
 import sys
-import time
-import schedule
+import asyncio
+import threading
+import functools
 from datetime import datetime
 from config_loader import load_config
+from http_transport import HttpTransport
 from jira_client import JiraClient
+from jira_sync import IncrementalSync
+from state_store import create_state_store
+from sharding import create_shard_coordinator
 from gitea_git_client import GiteaGitClient
 from jira_agent import JiraTaskAgent
 from review_agent import ReviewAgent
 from ai_client import AIClient
+from response_cache import ResponseCache
+from prompt_builder import PromptBuilder
+from runtime import AgentRuntime
+from health import HealthRegistry
+from metrics import start_metrics_server, record_tasks
+from webhooks import WebhookReceiver
 
 # Отключаем буферизацию вывода
 sys.stdout = open(sys.stdout.fileno(), 'w', buffering=1)
@@ -16,6 +28,113 @@ sys.stderr = open(sys.stderr.fileno(), 'w', buffering=1)
 
 print("🚀 Jira-Gitea Agents Starting...")
 
+class ProjectAgents:
+    """Клиенты и агенты одной пары: проект Jira -> репозиторий Gitea"""
+    
+    def __init__(self, project, system):
+        config = system.config
+        self.project = project
+        self.name = project['name']
+        # Сервис реестра здоровья для репозитория проекта
+        self.repo_service = f"gitea:{self.name}"
+        # Имя проекта в метриках и заданиях - только когда проектов несколько
+        self.label = label = self.name if len(config['projects']) > 1 else None
+        
+        self.jira = JiraClient(
+            url=config['jira']['url'],
+            username=config['jira']['username'],
+            password=config['jira']['password'],
+            project_key=project['jira_project'],
+            page_size=config['jira']['page_size'],
+            prefetch=config['jira']['prefetch'],
+            transport=system.transport,
+            scope_project=project['scoped']
+        )
+        
+        # Инкрементальная синхронизация по полю updated (опционально), водяные знаки - по проекту.
+        # Воркер пропускает чужие задачи, поэтому водяной знак у каждого воркера свой,
+        # а при смене состава воркеров (ключи переезжают) следующая выборка полная
+        self.sync = None
+        if config['sync']['incremental']:
+            watermarks = 'jira_watermarks'
+            if label:
+                watermarks += f"_{self.name}"
+            if config['sharding']['backend'] not in (None, '', 'none'):
+                watermarks += '_' + re.sub(r'[^A-Za-z0-9_.-]', '_', system.shard.worker_id)
+            self.sync = IncrementalSync(
+                jira_client=self.jira,
+                state_path=os.path.join(config['sync']['state_dir'], f"{watermarks}.json"),
+                full_sync_interval=config['sync']['full_sync_interval']
+            )
+            system.shard.on_rebalance(self.sync.reset)
+        
+        self.git = GiteaGitClient(
+            url=config['gitea']['url'],
+            token=config['gitea']['token'],
+            repo_owner=project['repo_owner'],
+            repo_name=project['repo_name'],
+            transport=system.transport,
+            skip_unchanged=config['gitea']['skip_unchanged'],
+            use_tree_index=config['gitea']['tree_index'],
+            max_write_retries=config['gitea']['write_retries'],
+            retry_max_delay=config['gitea']['retry_max_delay']
+        )
+        
+        # Агент обработки задач
+        self.task_agent = JiraTaskAgent(
+            jira_client=self.jira,
+            gitea_git_client=self.git,
+            username=config['jira']['agent_username'],
+            sync=self.sync,
+            state_store=system.state,
+            processed_ttl=config['sync']['processed_ttl'],
+            batch_commits=project['batch_commits'],
+            queue_capacity=config['agent']['queue_capacity'],
+            queue_batch=config['agent']['queue_batch'],
+            retry_attempts=config['agent']['retry_attempts'],
+            retry_delay=config['agent']['retry_delay'],
+            shard=system.shard,
+            name=label,
+            max_tasks_per_cycle=project['max_tasks_per_cycle']
+        )
+        
+        # Агент ревью
+        self.review_agent = ReviewAgent(
+            jira_client=self.jira,
+            ai_client=system.ai,
+            username=config['jira']['agent_username'],
+            sync=self.sync,
+            state_store=system.state,
+            max_workers=config['agent']['review_workers'],
+            jira_concurrency=config['agent']['review_jira_concurrency'],
+            combined_review=config['agent']['combined_review'],
+            queue_capacity=config['agent']['queue_capacity'],
+            queue_batch=config['agent']['queue_batch'],
+            retry_attempts=config['agent']['retry_attempts'],
+            retry_delay=config['agent']['retry_delay'],
+            shard=system.shard,
+            name=label,
+            max_tasks_per_cycle=project['max_tasks_per_cycle'],
+            review_interval=project['review_interval'],
+            ai_slots=system.ai_slots,
+            prompt_builder=system.prompts,
+            summarize_comments=config['ai']['summarize_comments'],
+            summary_ttl=config['ai']['summary_ttl'],
+            ai_sessions=config['ai']['sessions']
+        )
+    
+    def job_name(self, job):
+        return f"{job}:{self.label}" if self.label else job
+    
+    def owns_issue(self, issue_key):
+        """Относится ли задача к проекту (без ограничения проектом - любая)"""
+        if not self.project['scoped']:
+            return True
+        return issue_key.rsplit('-', 1)[0] == self.project['jira_project']
+    
+    def owns_repo(self, full_name):
+        return not full_name or full_name.lower() == f"{self.git.repo_owner}/{self.git.repo_name}".lower()
+
 class JiraGiteaAgent:
     def __init__(self):
         print("🔧 Loading configuration and initializing clients...")
@@ -23,66 +142,110 @@ class JiraGiteaAgent:
         # Загружаем конфигурацию
         self.config = load_config()
         
-        # Инициализируем клиенты
-        self.jira = JiraClient(
-            url=self.config['jira']['url'],
-            username=self.config['jira']['username'],
-            password=self.config['jira']['password'],
-            project_key=self.config['jira']['project_key']
+        # Здоровье сервисов: кэш статусов и предохранители, обновляется по исходу запросов
+        self.health = HealthRegistry(
+            ttl=self.config['http']['health_ttl'],
+            failure_threshold=self.config['http']['circuit_failure_threshold'],
+            reset_timeout=self.config['http']['circuit_reset_timeout']
         )
         
-        # Инициализируем Git клиент
-        self.git = GiteaGitClient(
-            url=self.config['gitea']['url'],
-            token=self.config['gitea']['token'],
-            repo_owner=self.config['gitea']['repo_owner'],
-            repo_name=self.config['gitea']['repo_name']
+        # Общий HTTP-транспорт для всех клиентов (пулы соединений, таймауты, повторы)
+        self.transport = HttpTransport(
+            pool_maxsize=self.config['http']['pool_size'],
+            timeout=self.config['http']['timeout'],
+            retries=self.config['http']['retries'],
+            backoff_factor=self.config['http']['backoff'],
+            health=self.health
         )
         
-        # Инициализируем AI клиент
-        self.ai = AIClient(
-            model_url=self.config['ai']['model_url']
+        # Хранилище состояния агентов (обработанные задачи и т.п.)
+        self.state = create_state_store(
+            backend=self.config['sync']['state_backend'],
+            state_dir=self.config['sync']['state_dir']
         )
         
+        # Владение задачами при нескольких воркерах (контейнерах) на одном проекте
+        self.shard = create_shard_coordinator(
+            backend=self.config['sharding']['backend'],
+            state_dir=self.config['sync']['state_dir'],
+            worker_id=self.config['sharding']['worker_id'],
+            lease_ttl=self.config['sharding']['lease_ttl']
+        )
+        print(f"🧩 Worker {self.shard.worker_id}: {len(self.shard.members())} worker(s) active")
         
-        # Инициализируем агента обработки задач
-        self.task_agent = JiraTaskAgent(
-            jira_client=self.jira,
-            gitea_git_client=self.git,
-            username=self.config['jira']['agent_username']
+        if self.config['sync']['incremental']:
+            print(f"🔁 Incremental Jira sync enabled (full sync every {self.config['sync']['full_sync_interval']}s)")
+        
+        # Кэш ответов AI (память + диск)
+        self.ai_cache = None
+        if self.config['ai']['cache_enabled']:
+            disk_path = None
+            if self.config['ai']['cache_persist']:
+                disk_path = os.path.join(self.config['sync']['state_dir'], 'ai_cache.db')
+            self.ai_cache = ResponseCache(
+                max_entries=self.config['ai']['cache_size'],
+                ttl=self.config['ai']['cache_ttl'],
+                disk_path=disk_path,
+                disk_max_entries=self.config['ai']['cache_disk_size']
+            )
+            print(f"🗄️  AI response cache enabled (memory: {self.config['ai']['cache_size']}, disk: {bool(disk_path)})")
+        
+        # Инициализируем AI клиент
+        self.ai = AIClient(
+            model_url=self.config['ai']['model_url'],
+            cache=self.ai_cache,
+            stream=self.config['ai']['stream'],
+            stream_timeout=self.config['ai']['stream_timeout'],
+            transport=self.transport,
+            keep_alive=self.config['ai']['keep_alive'],
+            session_limit=self.config['ai']['session_limit'],
+            session_max_tokens=self.config['ai']['session_max_tokens']
         )
         
-        # Инициализируем агента ревью
-        self.review_agent = ReviewAgent(
-            jira_client=self.jira,
-            ai_client=self.ai,  # ← Передаем AI клиент
-            username=self.config['jira']['agent_username']
+        # Пары "проект Jira -> репозиторий Gitea": свои клиенты и агенты,
+        # общие пулы соединений, AI клиент, хранилище и лимит параллельных запросов к Ollama
+        self.ai_slots = threading.BoundedSemaphore(max(1, self.config['agent']['ollama_num_parallel']))
+        # Бюджет токенов промптов; num_ctx по умолчанию подбирается под него
+        self.prompts = PromptBuilder(
+            budget=self.config['ai']['prompt_budget'],
+            description_budget=self.config['ai']['description_budget'],
+            combined_max_tokens=self.config['ai']['combined_max_tokens'],
+            num_ctx=self.config['ai']['num_ctx'] or None
         )
+        self.projects = [ProjectAgents(project, self) for project in self.config['projects']]
+        
+        # Активные проверки - только когда статус сервиса устарел
+        # Серверы Jira и Gitea у всех проектов общие - проверяем их по первому проекту,
+        # а репозиторий у каждого проекта свой и проверяется отдельно
+        self.health.register('jira', self.projects[0].jira.health_check)
+        self.health.register('gitea', self.projects[0].git.server_health_check)
+        self.health.register('ai', self.ai.health_check)
+        for project in self.projects:
+            self.health.register(project.repo_service, project.git.health_check)
+        
+        # Очередь событий вебхуков, создается в build_runtime при включенных вебхуках
+        self.events = None
         
         print("✅ All clients and agents initialized")
 
-    def health_check(self):
-        """Проверка доступности всех сервисов"""
+    def health_check(self, services=('jira', 'gitea', 'ai')):
+        """Проверка доступности сервисов (свежий статус берется из кэша без запросов)"""
         print("🏥 Health check...")
         
-        # Проверяем Jira
-        jira_ok, jira_msg = self.jira.health_check()
-        print(f"   Jira: {'✅' if jira_ok else '❌'} {jira_msg}")
+        names = {'jira': 'Jira', 'gitea': 'Gitea Git', 'ai': 'AI Model'}
+        all_ok = True
+        for service in services:
+            ok, message = self.health.check(service)
+            print(f"   {names.get(service, service)}: {'✅' if ok else '❌'} {message}")
+            all_ok = all_ok and ok
         
-        # Проверяем Gitea Git
-        git_ok, git_msg = self.git.health_check()
-        print(f"   Gitea Git: {'✅' if git_ok else '❌'} {git_msg}")
-        
-        # Проверяем AI
-        ai_ok, ai_msg = self.ai.health_check()
-        print(f"   AI Model: {'✅' if ai_ok else '❌'} {ai_msg}")
-        
-        return jira_ok and git_ok and ai_ok
+        return all_ok
 
-    def ensure_repository(self):
-        """Обеспечиваем существование репозитория"""
+    def ensure_repository(self, project):
+        """Обеспечиваем существование репозитория проекта"""
         try:
-            repo_ok, repo_msg = self.git.health_check()
+            # Проверка репозитория кэшируется отдельно для каждого проекта
+            repo_ok, repo_msg = self.health.check(project.repo_service)
             if repo_ok:
                 print("✅ Repository is accessible")
                 return True
@@ -93,35 +256,51 @@ class JiraGiteaAgent:
             print(f"❌ Repository check error: {e}")
             return False
 
-    def process_tasks(self):
+    def process_tasks(self, project):
         """Обработка In Progress задач в Jira (первый агент)"""
-        print(f"\n🤖 Task processing started at {datetime.now().strftime('%H:%M:%S')}")
+        print(f"\n🤖 Task processing [{project.name}] started at {datetime.now().strftime('%H:%M:%S')}")
         
-        if not self.health_check():
+        # Агенту обработки задач AI не нужен
+        if not self.health_check(('jira', 'gitea')):
             print("❌ Services not available for task processing")
             return
         
         # Проверяем репозиторий
-        if not self.ensure_repository():
+        if not self.ensure_repository(project):
             return
         
-        self.task_agent.process_my_tasks()
+        project.task_agent.process_my_tasks()
 
-    def review_tasks(self):
+    def review_tasks(self, project):
         """Проверка задач для ревью (второй агент)"""
-        self.review_agent.check_review_tasks()
+        if not self.health_check(('jira', 'ai')):
+            print("❌ Services not available for task review")
+            return
+        
+        project.review_agent.check_review_tasks()
+        
+        if self.ai_cache:
+            stats = self.ai_cache.stats()
+            print(f"   🗄️  AI cache: hit rate {stats['hit_rate']:.0%} "
+                  f"(memory {stats['memory_hits']}, disk {stats['disk_hits']}, misses {stats['misses']}, "
+                  f"evictions {stats['evictions']})")
 
     def show_repository_status(self):
-        """Показать статус репозитория"""
+        """Показать статус репозиториев всех проектов"""
         moscow_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S MSK')
-        print(f"\n🐙 Repository status at {moscow_time}")
         
-        if not self.git.health_check()[0]:
+        if not self.health.check('gitea')[0]:
+            print(f"\n🐙 Repository status at {moscow_time}")
             print("❌ Git client not available")
             return
         
+        for project in self.projects:
+            print(f"\n🐙 Repository {project.git.repo_owner}/{project.git.repo_name} status at {moscow_time}")
+            self._show_repository_status(project.git)
+    
+    def _show_repository_status(self, git):
         # Получаем список файлов в репозитории
-        success, files = self.git.list_files()
+        success, files = git.list_files()
         if success:
             task_files = [f for f in files if f['name'].endswith('.txt') and f['type'] == 'file']
             print(f"   📁 Task files in repository: {len(task_files)}")
@@ -129,7 +308,7 @@ class JiraGiteaAgent:
                 print(f"      - {file['name']}")
     
         # Проверяем время последних коммитов
-        success, commits = self.git.get_commits(limit=3)
+        success, commits = git.get_commits(limit=3)
         if success and commits:
             print(f"   ⏰ Last 3 commits:")
             for commit in commits:
@@ -168,6 +347,76 @@ class JiraGiteaAgent:
         else:
             print(f"   ❌ AI Error: {response}")
 
+    def handle_events(self, items):
+        """Обработка пачки событий вебхуков: только затронутые задачи, без полного опроса"""
+        print(f"\n🪝 {len(items)} webhook event(s)")
+        for project in self.projects:
+            task_keys, review_keys = [], []
+            for item in items:
+                if item.kind == 'gitea_push' and project.owns_repo(item.data.get('repo')):
+                    # Чужой push: индекс дерева ветки больше не совпадает с репозиторием
+                    project.git.note_push(item.key, item.data.get('head'))
+                elif item.kind == 'jira_issue' and project.owns_issue(item.key):
+                    # Статус из события может устареть - агент все равно перечитает задачу по JQL
+                    if item.status in (None, 'In Progress') and item.key not in task_keys:
+                        task_keys.append(item.key)
+                    if item.status in (None, 'In Review') and item.key not in review_keys:
+                        review_keys.append(item.key)
+            
+            if task_keys and self.health_check(('jira', 'gitea')):
+                project.task_agent.process_task_keys(task_keys)
+            if review_keys and self.health_check(('jira', 'ai')):
+                project.review_agent.review_task_keys(review_keys)
+    
+    def drain_queues(self):
+        """Обработать созревшие отложенные повторы и остатки из очередей агентов (по очереди проектов).
+        
+        Агент, занятый своим циклом, пропускаем: он сам разберет очередь, а остальные
+        проекты не должны его ждать.
+        """
+        for project in self.projects:
+            for agent in (project.task_agent, project.review_agent):
+                if len(agent.queue):
+                    record_tasks(agent.metrics_name, agent.drain_queue(agent.max_tasks_per_cycle, wait=False))
+    
+    def build_runtime(self):
+        """Собрать рантайм: каждый агент - отдельная периодическая задача"""
+        agent_config = self.config['agent']
+        runtime = AgentRuntime(
+            max_threads=agent_config['runtime_threads'],
+            shutdown_timeout=agent_config['shutdown_timeout']
+        )
+        jitter = agent_config['schedule_jitter']
+        webhooks = self.config['webhooks']
+        if webhooks['enabled']:
+            self.events = runtime.add_consumer('webhook_events', self.handle_events, webhooks['batch_window'])
+        
+        # У каждого проекта свои задания: большой проект не задерживает опрос остальных
+        for project in self.projects:
+            task_interval = project.project['task_process_interval']
+            review_interval = project.review_agent.timeDelay
+            if webhooks['enabled']:
+                # Работу приносят вебхуки, опрос лишь догоняет пропущенные события
+                task_interval = max(task_interval, webhooks['reconcile_interval'])
+                review_interval = max(review_interval, webhooks['reconcile_interval'])
+            runtime.add_job(project.job_name('process_tasks'), functools.partial(self.process_tasks, project),
+                            task_interval, jitter)
+            runtime.add_job(project.job_name('review_tasks'), functools.partial(self.review_tasks, project),
+                            review_interval, jitter)
+        if self.config['sharding']['backend'] not in (None, '', 'none'):
+            # Heartbeat держит воркера в группе и продлевает его аренды
+            runtime.add_job('worker_heartbeat', self.shard.heartbeat,
+                            max(1, self.config['sharding']['lease_ttl'] // 3), jitter, run_immediately=False)
+        # Повторы после ошибок ждут в очередях агентов, не дожидаясь следующего опроса
+        runtime.add_job('drain_queues', self.drain_queues, agent_config['queue_drain_interval'], jitter,
+                        run_immediately=False)
+        runtime.add_job('repository_status', self.show_repository_status, agent_config['status_interval'], jitter)
+        # Каждый час удаляем просроченные записи обработанных задач
+        # Хранилище общее для всех проектов
+        runtime.add_job('purge_state', self.projects[0].task_agent.clear_processed_cache, 3600, jitter,
+                        run_immediately=False)
+        return runtime
+    
     def run(self):
         """Запуск всех агентов"""
         print("=" * 50)
@@ -180,34 +429,34 @@ class JiraGiteaAgent:
         # Тестируем AI
         self.test_ai()
         
-        # Первый запуск всех функций
-        self.process_tasks()
-        self.review_tasks()
-        self.show_repository_status()
-        
-        # Планирование периодического выполнения
-        schedule.every(self.config['agent']['task_process_interval']).seconds.do(self.process_tasks)
-        schedule.every(self.review_agent.timeDelay).seconds.do(self.review_tasks)
-        schedule.every(300).seconds.do(self.show_repository_status)
-        
-        print(f"⏰ Next task processing in {self.config['agent']['task_process_interval']} seconds")
-        print(f"⏰ Next review check in {self.review_agent.timeDelay} seconds")
-        print(f"⏰ Next repository status in 300 seconds")
-        
-        # Главный цикл
-        counter = 0
-        while True:
-            schedule.run_pending()
-            counter += 1
-            
-            # Каждый час очищаем кэш обработанных задач
-            if counter % 3600 == 0:
-                self.task_agent.clear_processed_cache()
-            
-            if counter % 30 == 0:
-                print(f"⏰ All agents running... ({counter//60}m {counter%60}s)")
-            
-            time.sleep(1)
+        # Метрики Prometheus (опционально)
+        if self.config['agent']['metrics_enabled']:
+            start_metrics_server(self.config['agent']['metrics_host'], self.config['agent']['metrics_port'])
+        
+        runtime = self.build_runtime()
+        for job in runtime.jobs:
+            print(f"⏰ {job.name}: every {job.interval} seconds")
+        
+        receiver = None
+        if self.config['webhooks']['enabled']:
+            webhooks = self.config['webhooks']
+            receiver = WebhookReceiver(
+                dispatch=self.events.submit,
+                host=webhooks['host'],
+                port=webhooks['port'],
+                jira_secret=webhooks['jira_secret'],
+                gitea_secret=webhooks['gitea_secret']
+            ).start()
+        
+        # Агенты работают независимо: долгое ревью не задерживает обработку задач
+        try:
+            asyncio.run(runtime.run())
+        finally:
+            if receiver:
+                receiver.stop()
+            # Отдаем свои задачи остальным воркерам сразу, не дожидаясь истечения heartbeat
+            self.shard.leave()
+            self.transport.close()
 
 if __name__ == "__main__":
     try:
@@ -1,17 +1,45 @@
 import requests
 import json
+import time
+import threading
+from collections import OrderedDict
+from http_transport import HttpTransport
+from metrics import instrumented
+
+class AIStreamError(Exception):
+    """Ошибка потоковой генерации"""
+
+# Причины остановки потока, при которых ответ получен целиком
+COMPLETE_STOPS = ('done', 'stop')
 
 class AIClient:
-    def __init__(self, model_url):
+    def __init__(self, model_url, cache=None, stream=False, stream_timeout=60, transport=None,
+                 keep_alive=None, session_limit=64, session_max_tokens=2048):
         self.model_url = model_url
+        # Необязательный кэш ответов (ResponseCache)
+        self.cache = cache
+        # Потоковый режим: таймаут считается между чанками, а не на весь ответ
+        self.stream = stream
+        self.stream_timeout = stream_timeout
+        # Сколько Ollama держит модель в памяти после запроса ("30m", -1 - всегда)
+        self.keep_alive = keep_alive
+        # Сессии по задачам: общий префикс промптов вычисляется моделью один раз,
+        # дальше запросы передают его KV-контекст (поле context /api/generate).
+        # Число сессий и размер контекста каждой ограничены
+        self.session_limit = max(1, session_limit)
+        self.session_max_tokens = session_max_tokens
+        self._sessions = OrderedDict()
+        self._sessions_lock = threading.Lock()
         self.headers = {
             'Content-Type': 'application/json'
         }
+        self.session = (transport or HttpTransport()).session(headers=self.headers, service='ai')
     
+    @instrumented('ai')
     def health_check(self):
         """Проверка доступности AI модели"""
         try:
-            response = requests.get(f"{self.model_url}/api/tags", timeout=10)
+            response = self.session.get(f"{self.model_url}/api/tags", timeout=10)
             if response.status_code == 200:
                 models_data = response.json()
                 models = [model['name'] for model in models_data.get('models', [])]
@@ -21,35 +49,138 @@ class AIClient:
         except Exception as e:
             return False, f"AI connection failed: {e}"
     
-    def generate_response(self, prompt, model="llama3.1", temperature=0.7, max_tokens=500):
-        """Генерация ответа на промпт для llama3.1"""
+    def open_session(self, key, preamble):
+        """Открыть сессию: preamble - общее начало всех промптов о задаче key.
+        
+        Контекст префикса запрашивается у модели лениво, при первом запросе сессии.
+        """
+        with self._sessions_lock:
+            session = self._sessions.get(key)
+            if session is None or session['preamble'] != preamble:
+                session = {'preamble': preamble, 'context': None, 'options': None}
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.session_limit:
+                self._sessions.popitem(last=False)
+    
+    def close_session(self, key):
+        """Забыть сессию и ее контекст"""
+        with self._sessions_lock:
+            self._sessions.pop(key, None)
+    
+    def _session_context(self, session, model, num_ctx):
+        """KV-контекст префикса сессии; None - префикс придется передать текстом.
+        
+        Префикс вычисляется одним коротким запросом (num_predict=1). Возвращенный
+        context - это префикс в шаблоне чата вместе с одним токеном ответа, так что
+        промпты сессии идут следующей репликой после него, а не продолжением того же
+        текста. Зато каждый запрос сессии начинается с тех же токенов, и Ollama
+        берет их из KV-кэша загруженной модели вместо повторного вычисления.
+        Контекст длиннее session_max_tokens не храним.
+        """
+        options = (model, num_ctx)
+        if session['options'] == options:
+            return session['context']
+        
+        payload = {
+            "model": model,
+            "prompt": session['preamble'],
+            "stream": False,
+            "options": {"temperature": 0, "num_predict": 1}
+        }
+        if num_ctx:
+            payload["options"]["num_ctx"] = num_ctx
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        
+        context = None
+        try:
+            response = self.session.post(f"{self.model_url}/api/generate", json=payload, timeout=60)
+            if response.status_code == 200:
+                context = response.json().get('context') or None
+        except requests.exceptions.RequestException as e:
+            print(f"   ⚠️  AI session prefix failed, sending full prompts: {e}")
+        if context and self.session_max_tokens and len(context) > self.session_max_tokens:
+            context = None
+        
+        # Неудачу тоже запоминаем, чтобы не повторять запрос префикса на каждом промпте
+        session['context'], session['options'] = context, options
+        return context
+    
+    @instrumented('ai')
+    def generate_response(self, prompt, model="llama3.1", temperature=0.7, max_tokens=500,
+                          response_format=None, num_ctx=None, session=None, validate=None):
+        """Генерация ответа на промпт для llama3.1 (response_format: "json" или JSON-схема).
+        
+        num_ctx - размер контекста модели; лучше держать постоянным, иначе Ollama перезагружает модель.
+        session - ключ сессии (open_session): промпт продолжает ее общий префикс.
+        validate(text) -> bool: кэшируется только прошедший проверку ответ.
+        """
         try:
             url = f"{self.model_url}/api/generate"
             
+            with self._sessions_lock:
+                current = self._sessions.get(session) if session is not None else None
+            preamble = current['preamble'] if current else None
+            context = self._session_context(current, model, num_ctx) if current else None
+            
             payload = {
                 "model": model,
                 "prompt": prompt,
                 "stream": False,
-                "options": {
-                    "temperature": temperature,
-                    "num_predict": max_tokens,
-                    "top_k": 40,
-                    "top_p": 0.9,
-                    "repeat_penalty": 1.1
-                }
+                "options": self._options(temperature, max_tokens)
             }
+            if response_format is not None:
+                payload["format"] = response_format
+            if num_ctx:
+                payload["options"]["num_ctx"] = num_ctx
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=60)
+            # Повторяющиеся промпты отдаем из кэша без обращения к модели.
+            # Ключ - полный текст промпта и режим: в сессии модель видит префикс
+            # отдельной репликой (с шаблоном чата и своим ответом на нее), поэтому
+            # ответ в сессии и без нее - разные записи кэша
+            if preamble is not None:
+                payload["prompt"] = preamble + prompt
+            key_material = dict(payload, session=True) if context else payload
+            cache_key = self.cache.make_key('generate', key_material) if self.cache else None
+            cached = self.cache.get(cache_key) if cache_key else None
+            if cached is not None and validate is not None and not validate(cached):
+                self.cache.delete(cache_key)
+                cached = None
+            if cached is not None:
+                return True, cached
+            
+            if context:
+                payload["prompt"] = prompt
+                payload["context"] = context
+            if self.keep_alive is not None:
+                payload["keep_alive"] = self.keep_alive
+            
+            if self.stream:
+                stats = {}
+                success, text = self._collect_stream('generate', payload, self._generate_token, stats=stats)
+                if success and stats.get('stopped') not in COMPLETE_STOPS:
+                    # Оборванный ответ не годится ни для ревью, ни для кэша
+                    return False, f"AI stream incomplete ({stats.get('stopped')})"
+                if success and cache_key and (validate is None or validate(text)):
+                    self.cache.set(cache_key, text)
+                return success, text
+            
+            response = self.session.post(url, json=payload, timeout=60)
             
             if response.status_code == 200:
                 result = response.json()
-                return True, result.get('response', 'No response generated')
+                text = result.get('response', 'No response generated')
+                if cache_key and (validate is None or validate(text)):
+                    self.cache.set(cache_key, text)
+                return True, text
             else:
                 return False, f"AI API error: {response.status_code} - {response.text}"
                 
         except Exception as e:
             return False, f"Error generating AI response: {e}"
     
+    @instrumented('ai')
     def chat_completion(self, messages, model="llama3.1", temperature=0.7, max_tokens=500):
         """Чат-комpletion для llama3.1"""
         try:
@@ -59,30 +190,203 @@ class AIClient:
                 "model": model,
                 "messages": messages,
                 "stream": False,
-                "options": {
-                    "temperature": temperature,
-                    "num_predict": max_tokens,
-                    "top_k": 40,
-                    "top_p": 0.9,
-                    "repeat_penalty": 1.1
-                }
+                "options": self._options(temperature, max_tokens)
             }
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=60)
+            # Повторяющиеся промпты отдаем из кэша без обращения к модели
+            cache_key = self.cache.make_key('chat', payload) if self.cache else None
+            cached = self.cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                return True, cached
+            
+            if self.keep_alive is not None:
+                payload["keep_alive"] = self.keep_alive
+            
+            if self.stream:
+                stats = {}
+                success, text = self._collect_stream('chat', payload, self._chat_token, stats=stats)
+                if success and stats.get('stopped') not in COMPLETE_STOPS:
+                    # Оборванный ответ не годится ни для ревью, ни для кэша
+                    return False, f"AI stream incomplete ({stats.get('stopped')})"
+                if success and cache_key:
+                    self.cache.set(cache_key, text)
+                return success, text
+            
+            response = self.session.post(url, json=payload, timeout=60)
             
             if response.status_code == 200:
                 result = response.json()
-                return True, result.get('message', {}).get('content', 'No response generated')
+                text = result.get('message', {}).get('content', 'No response generated')
+                if cache_key:
+                    self.cache.set(cache_key, text)
+                return True, text
             else:
                 return False, f"AI chat API error: {response.status_code} - {response.text}"
                 
         except Exception as e:
             return False, f"Error in AI chat: {e}"
     
+    @staticmethod
+    def _generate_token(chunk):
+        return chunk.get('response', '')
+    
+    @staticmethod
+    def _chat_token(chunk):
+        return chunk.get('message', {}).get('content', '')
+    
+    @staticmethod
+    def _options(temperature, max_tokens):
+        return {
+            "temperature": temperature,
+            "num_predict": max_tokens,
+            "top_k": 40,
+            "top_p": 0.9,
+            "repeat_penalty": 1.1
+        }
+    
+    def _stream(self, endpoint, payload, extract, stop=None, token_budget=None, stats=None):
+        """Потоковый запрос к Ollama: разбор NDJSON и выдача текста по мере генерации.
+        
+        stats - словарь вызывающего, куда пишутся TTFT, скорость и причина остановки
+        (клиент общий для всех воркеров, поэтому статистика не хранится в нем).
+        """
+        stats = stats if stats is not None else {}
+        stats.clear()
+        payload = dict(payload, stream=True)
+        
+        started = time.monotonic()
+        first_token_at = None
+        tokens = 0
+        # Хвост, который может оказаться началом стоп-последовательности
+        pending = ''
+        hold = len(stop) - 1 if stop else 0
+        # Поток, закрытый без итогового чанка done, - неполный ответ
+        stats['stopped'] = 'eof'
+        
+        url = f"{self.model_url}/api/{endpoint}"
+        with self.session.post(url, json=payload, stream=True,
+                               timeout=(10, self.stream_timeout)) as response:
+            if response.status_code != 200:
+                raise AIStreamError(f"AI API error: {response.status_code} - {response.text}")
+            
+            for line in response.iter_lines(chunk_size=None):
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise AIStreamError(f"AI stream error: {chunk['error']}")
+                
+                token = extract(chunk)
+                if token:
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                        stats['ttft'] = round(first_token_at - started, 3)
+                    tokens += 1
+                    pending += token
+                    
+                    if stop and stop in pending:
+                        head = pending[:pending.index(stop)]
+                        if head:
+                            yield head
+                        pending = ''
+                        stats['stopped'] = 'stop'
+                        break
+                    
+                    if len(pending) > hold:
+                        cut = len(pending) - hold
+                        yield pending[:cut]
+                        pending = pending[cut:]
+                    
+                    if token_budget and tokens >= token_budget:
+                        stats['stopped'] = 'budget'
+                        break
+                
+                if chunk.get('done'):
+                    stats['stopped'] = 'done'
+                    # Итоговый чанк содержит точные счетчики Ollama (длительности в наносекундах)
+                    stats['eval_count'] = chunk.get('eval_count', tokens)
+                    stats['prompt_eval_count'] = chunk.get('prompt_eval_count')
+                    eval_duration = chunk.get('eval_duration')
+                    if eval_duration:
+                        stats['tokens_per_sec'] = round(stats['eval_count'] / (eval_duration / 1e9), 2)
+                    stats['done_reason'] = chunk.get('done_reason')
+                    break
+        
+        if pending:
+            yield pending
+        
+        stats['tokens'] = tokens
+        stats['duration'] = round(time.monotonic() - started, 3)
+        if 'tokens_per_sec' not in stats and first_token_at is not None and tokens:
+            # Генерацию прервали раньше итогового чанка - считаем скорость на клиенте
+            elapsed = time.monotonic() - first_token_at
+            stats['tokens_per_sec'] = round(tokens / elapsed, 2) if elapsed > 0 else None
+    
+    def stream_generate(self, prompt, model="llama3.1", temperature=0.7, max_tokens=500,
+                        stop=None, token_budget=None, stats=None):
+        """Потоковая генерация: отдает текст по мере поступления токенов"""
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "options": self._options(temperature, max_tokens)
+        }
+        return self._stream('generate', payload, self._generate_token, stop, token_budget, stats)
+    
+    def stream_chat(self, messages, model="llama3.1", temperature=0.7, max_tokens=500,
+                    stop=None, token_budget=None, stats=None):
+        """Потоковый чат: отдает текст по мере поступления токенов"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "options": self._options(temperature, max_tokens)
+        }
+        return self._stream('chat', payload, self._chat_token, stop, token_budget, stats)
+    
+    def _collect_stream(self, endpoint, payload, extract, stop=None, token_budget=None, stats=None):
+        """Собрать потоковый ответ целиком; при обрыве вернуть накопленную часть.
+        
+        Причина остановки - в stats['stopped']: 'timeout' означает неполный ответ.
+        """
+        parts = []
+        stats = stats if stats is not None else {}
+        try:
+            for text in self._stream(endpoint, payload, extract, stop, token_budget, stats):
+                parts.append(text)
+        except AIStreamError as e:
+            return False, str(e)
+        except requests.exceptions.RequestException as e:
+            if not parts:
+                return False, f"Error streaming AI response: {e}"
+            stats['stopped'] = 'timeout'
+            print(f"   ⚠️  AI stream interrupted after {len(parts)} chunks, using partial output: {e}")
+        
+        if stats.get('ttft') is not None:
+            print(f"   ⏱️  AI stream: TTFT {stats['ttft']}s, {stats.get('tokens_per_sec')} tok/s, "
+                  f"stopped: {stats['stopped']}")
+        return True, ''.join(parts) or 'No response generated'
+    
+    @instrumented('ai')
+    def generate_response_stream(self, prompt, model="llama3.1", temperature=0.7, max_tokens=500,
+                                 stop=None, token_budget=None, stats=None):
+        """Генерация через потоковый режим с ранней остановкой по стоп-строке или бюджету токенов.
+        
+        При обрыве возвращается накопленная часть; причина остановки - в stats['stopped'].
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "options": self._options(temperature, max_tokens)
+        }
+        try:
+            return self._collect_stream('generate', payload, self._generate_token, stop, token_budget, stats)
+        except Exception as e:
+            return False, f"Error generating AI response: {e}"
+    
+    @instrumented('ai')
     def get_available_models(self):
         """Получить список доступных моделей"""
         try:
-            response = requests.get(f"{self.model_url}/api/tags", timeout=10)
+            response = self.session.get(f"{self.model_url}/api/tags", timeout=10)
             
             if response.status_code == 200:
                 models_data = response.json()
@@ -0,0 +1,513 @@
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FaultProfile:
+    """Задержка и внедрение ошибок для фейкового сервиса"""
+    
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def delay(self):
+        with self._lock:
+            spread = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0
+        return max(0.0, self.latency + spread)
+    
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+class FakeService:
+    """Фейковый HTTP-сервис в фоновом потоке с маршрутизацией по регулярным выражениям"""
+    
+    name = 'service'
+    
+    def __init__(self, faults=None):
+        self.faults = faults or FaultProfile()
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.routes = []
+        self._server = None
+        self._thread = None
+    
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def route(self, method, pattern, handler, endpoint):
+        self.routes.append((method, re.compile(pattern), handler, endpoint))
+    
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+    
+    def reset_counters(self):
+        with self.lock:
+            self.requests = {}
+    
+    def dispatch(self, method, path, query, body):
+        """Вернуть (status, json или bytes-итератор для потокового ответа)"""
+        for route_method, pattern, handler, endpoint in self.routes:
+            if route_method != method:
+                continue
+            match = pattern.fullmatch(path)
+            if match:
+                self.count(endpoint)
+                time.sleep(self.faults.delay())
+                if self.faults.should_fail():
+                    return self.faults.error_status, {'message': 'injected failure'}
+                return handler(query, body, *[unquote(g) for g in match.groups()])
+        self.count('unmatched')
+        return 404, {'message': f'no route for {method} {path}'}
+    
+    def start(self, host='127.0.0.1', port=0):
+        service = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Без Nagle заголовки и тело ответа не ждут ACK (иначе +40 мс на запрос)
+            disable_nagle_algorithm = True
+            
+            def _handle(self, method):
+                parsed = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                body = json.loads(raw) if raw else None
+                status, payload = service.dispatch(method, parsed.path, query, body)
+                
+                if status == 204:
+                    self.send_response(204)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                elif isinstance(payload, (dict, list)):
+                    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                else:
+                    # Потоковый ответ (NDJSON) чанками
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/x-ndjson')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    for chunk in payload:
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        self.wfile.flush()
+                    self.wfile.write(b'0\r\n\r\n')
+            
+            def do_GET(self):
+                self._handle('GET')
+            
+            def do_POST(self):
+                self._handle('POST')
+            
+            def do_PUT(self):
+                self._handle('PUT')
+            
+            def do_DELETE(self):
+                self._handle('DELETE')
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f'fake-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+class FakeJira(FakeService):
+    """Jira REST v2: search, comment, transitions, issue"""
+    
+    name = 'jira'
+    TRANSITIONS = {
+        'To Do': [('11', 'In Progress')],
+        'In Progress': [('21', 'In Review'), ('11', 'To Do')],
+        'In Review': [('31', 'Done'), ('21', 'In Progress')],
+        'Done': []
+    }
+    STATUS_IDS = {'To Do': '1', 'In Progress': '3', 'In Review': '10001', 'Done': '10002'}
+    
+    def __init__(self, project_key='BENCH', embedded_comments=20, faults=None):
+        super().__init__(faults)
+        self.project_key = project_key
+        self.embedded_comments = embedded_comments
+        self.issues = {}
+        self._clock = 0
+        base = r'/rest/api/2'
+        self.route('GET', base + r'/serverInfo', self._server_info, 'serverInfo')
+        self.route('GET', base + r'/myself', self._myself, 'myself')
+        self.route('GET', base + r'/search', self._search, 'search')
+        self.route('GET', base + r'/issue/([^/]+)', self._issue, 'issue')
+        self.route('GET', base + r'/issue/([^/]+)/comment', self._comments, 'comment:list')
+        self.route('POST', base + r'/issue/([^/]+)/comment', self._add_comment, 'comment:add')
+        self.route('GET', base + r'/issue/([^/]+)/transitions', self._transitions, 'transitions:list')
+        self.route('POST', base + r'/issue/([^/]+)/transitions', self._transition, 'transitions:do')
+    
+    def _timestamp(self):
+        self._clock += 1
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1700000000 + self._clock)) + '.000+0000'
+    
+    def seed(self, count, status, assignee, comments=0, prefix=None):
+        """Создать count синтетических задач в статусе status"""
+        with self.lock:
+            start = len(self.issues)
+            for i in range(start, start + count):
+                key = f"{prefix or self.project_key}-{i + 1}"
+                updated = self._timestamp()
+                self.issues[key] = {
+                    'key': key,
+                    'status': status,
+                    'assignee': assignee,
+                    'summary': f"Synthetic task {i + 1}",
+                    'description': f"Benchmark task {i + 1}. " + "Details. " * 20,
+                    'created': updated,
+                    'updated': updated,
+                    'comments': [
+                        {
+                            'id': str(i * 1000 + c),
+                            'body': f"Выполнено: шаг {c + 1} для задачи {key}",
+                            'created': updated,
+                            'updated': updated,
+                            'author': {'name': assignee}
+                        }
+                        for c in range(comments)
+                    ]
+                }
+    
+    def _fields(self, issue, requested):
+        fields = {
+            'summary': issue['summary'],
+            'description': issue['description'],
+            'status': {'name': issue['status'], 'id': self.STATUS_IDS[issue['status']]},
+            'assignee': {'name': issue['assignee']},
+            'created': issue['created'],
+            'updated': issue['updated'],
+            'issuetype': {'id': '10000', 'name': 'Task'},
+            'project': {'key': issue['key'].rsplit('-', 1)[0]}
+        }
+        if 'comment' in requested:
+            comments = issue['comments']
+            fields['comment'] = {
+                'comments': comments[:self.embedded_comments],
+                'startAt': 0,
+                'maxResults': self.embedded_comments,
+                'total': len(comments)
+            }
+        return fields
+    
+    def _matches(self, issue, jql):
+        status = re.search(r"status\s*=\s*['\"]([^'\"]+)['\"]", jql)
+        if status and issue['status'] != status.group(1):
+            return False
+        assignee = re.search(r"assignee\s*=\s*['\"]([^'\"]+)['\"]", jql)
+        if assignee and issue['assignee'] != assignee.group(1):
+            return False
+        project = re.search(r"project\s*=\s*['\"]?([A-Z0-9_]+)", jql)
+        if project and issue['key'].rsplit('-', 1)[0] != project.group(1):
+            return False
+        keys = re.search(r"key\s+in\s*\(([^)]*)\)", jql)
+        if keys and issue['key'] not in {k.strip(' \'"') for k in keys.group(1).split(',')}:
+            return False
+        return True
+    
+    def _server_info(self, query, body):
+        return 200, {'version': 'fake-9.0', 'serverTitle': 'Fake Jira'}
+    
+    def _myself(self, query, body):
+        return 200, {'name': 'bench', 'timeZone': 'UTC'}
+    
+    def _search(self, query, body):
+        jql = query.get('jql', '')
+        start_at = int(query.get('startAt', 0))
+        max_results = min(int(query.get('maxResults', 50)), 100)
+        requested = set((query.get('fields') or '').split(','))
+        with self.lock:
+            matched = [issue for issue in self.issues.values() if self._matches(issue, jql)]
+            page = [
+                {'key': issue['key'], 'fields': self._fields(issue, requested)}
+                for issue in matched[start_at:start_at + max_results]
+            ]
+        return 200, {'startAt': start_at, 'maxResults': max_results, 'total': len(matched), 'issues': page}
+    
+    def _issue(self, query, body, key):
+        with self.lock:
+            issue = self.issues.get(key)
+            if issue is None:
+                return 404, {'errorMessages': ['Issue does not exist']}
+            return 200, {'key': key, 'fields': self._fields(issue, {'comment'})}
+    
+    def _comments(self, query, body, key):
+        start_at = int(query.get('startAt', 0))
+        max_results = int(query.get('maxResults', 50))
+        with self.lock:
+            issue = self.issues.get(key)
+            if issue is None:
+                return 404, {'errorMessages': ['Issue does not exist']}
+            comments = issue['comments']
+            return 200, {
+                'startAt': start_at,
+                'maxResults': max_results,
+                'total': len(comments),
+                'comments': comments[start_at:start_at + max_results]
+            }
+    
+    def _add_comment(self, query, body, key):
+        with self.lock:
+            issue = self.issues.get(key)
+            if issue is None:
+                return 404, {'errorMessages': ['Issue does not exist']}
+            updated = self._timestamp()
+            comment = {'id': str(100000 + self._clock), 'body': body.get('body', ''), 'created': updated, 'updated': updated}
+            issue['comments'].append(comment)
+            issue['updated'] = updated
+            return 201, comment
+    
+    def _transitions(self, query, body, key):
+        with self.lock:
+            issue = self.issues.get(key)
+            if issue is None:
+                return 404, {'errorMessages': ['Issue does not exist']}
+            return 200, {'transitions': [
+                {'id': tid, 'name': name, 'to': {'name': name}}
+                for tid, name in self.TRANSITIONS[issue['status']]
+            ]}
+    
+    def _transition(self, query, body, key):
+        with self.lock:
+            issue = self.issues.get(key)
+            if issue is None:
+                return 404, {'errorMessages': ['Issue does not exist']}
+            target = dict(self.TRANSITIONS[issue['status']]).get(body['transition']['id'])
+            if target is None:
+                return 400, {'errorMessages': ['Transition is not valid for this issue']}
+            issue['status'] = target
+            issue['updated'] = self._timestamp()
+            return 204, None
+
+class FakeGitea(FakeService):
+    """Gitea API v1: contents (в т.ч. change-files), trees, branches, commits"""
+    
+    name = 'gitea'
+    
+    def __init__(self, owner='bench', repo='tasks', branch='main', faults=None):
+        super().__init__(faults)
+        self.owner = owner
+        self.repo = repo
+        self.branch = branch
+        self.files = {}
+        self.commits = []
+        self.head = self._commit_sha('init')
+        base = rf'/api/v1/repos/{re.escape(owner)}/{re.escape(repo)}'
+        self.route('GET', r'/api/v1/version', self._version, 'version')
+        self.route('GET', base, self._repo, 'repo')
+        self.route('GET', base + r'/branches/([^/]+)', self._branch, 'branch')
+        self.route('GET', base + r'/git/trees/([^/]+)', self._tree, 'tree')
+        self.route('GET', base + r'/commits', self._list_commits, 'commits')
+        self.route('POST', base + r'/contents', self._change_files, 'contents:batch')
+        self.route('GET', base + r'/contents/?', self._list_root, 'contents:list')
+        self.route('GET', base + r'/contents/(.+)', self._get_file, 'contents:get')
+        self.route('POST', base + r'/contents/(.+)', self._create_file, 'contents:create')
+        self.route('PUT', base + r'/contents/(.+)', self._update_file, 'contents:update')
+        self.route('DELETE', base + r'/contents/(.+)', self._delete_file, 'contents:delete')
+    
+    @staticmethod
+    def _blob_sha(data):
+        return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+    
+    @staticmethod
+    def _commit_sha(seed):
+        return hashlib.sha1(f"{seed}:{time.time()}:{random.random()}".encode()).hexdigest()
+    
+    def _commit(self, message):
+        parent = self.head
+        self.head = self._commit_sha(message)
+        commit = {
+            'sha': self.head,
+            'parents': [{'sha': parent}],
+            'commit': {'message': message, 'committer': {'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}}
+        }
+        self.commits.append(commit)
+        return commit
+    
+    def _version(self, query, body):
+        return 200, {'version': '1.21.0'}
+    
+    def _repo(self, query, body):
+        return 200, {'full_name': f"{self.owner}/{self.repo}", 'default_branch': self.branch}
+    
+    def _branch(self, query, body, branch):
+        with self.lock:
+            return 200, {'name': branch, 'commit': {'id': self.head}}
+    
+    def _tree(self, query, body, sha):
+        page = int(query.get('page', 1))
+        per_page = int(query.get('per_page', 1000))
+        with self.lock:
+            entries = [
+                {'path': path, 'type': 'blob', 'mode': '100644', 'sha': self._blob_sha(data), 'size': len(data)}
+                for path, data in sorted(self.files.items())
+            ]
+        chunk = entries[(page - 1) * per_page:page * per_page]
+        return 200, {
+            'sha': sha,
+            'tree': chunk,
+            'truncated': page * per_page < len(entries),
+            'page': page,
+            'total_count': len(entries)
+        }
+    
+    def _list_commits(self, query, body):
+        limit = int(query.get('limit', 5))
+        with self.lock:
+            return 200, list(reversed(self.commits[-limit:]))
+    
+    def _list_root(self, query, body):
+        with self.lock:
+            return 200, [
+                {'name': path, 'path': path, 'type': 'file', 'size': len(data)}
+                for path, data in sorted(self.files.items()) if '/' not in path
+            ]
+    
+    def _content(self, path, data):
+        return {'path': path, 'name': path.rsplit('/', 1)[-1], 'sha': self._blob_sha(data), 'size': len(data)}
+    
+    def _get_file(self, query, body, path):
+        with self.lock:
+            data = self.files.get(path)
+        if data is None:
+            return 404, {'message': 'file does not exist'}
+        return 200, dict(self._content(path, data), content=base64.b64encode(data).decode('ascii'), encoding='base64')
+    
+    def _create_file(self, query, body, path):
+        with self.lock:
+            if path in self.files:
+                return 422, {'message': 'repository file already exists'}
+            data = base64.b64decode(body['content'])
+            self.files[path] = data
+            return 201, {'content': self._content(path, data), 'commit': self._commit(body.get('message', ''))}
+    
+    def _update_file(self, query, body, path):
+        with self.lock:
+            if path not in self.files:
+                return 404, {'message': 'file does not exist'}
+            if body.get('sha') != self._blob_sha(self.files[path]):
+                return 409, {'message': 'sha does not match'}
+            data = base64.b64decode(body['content'])
+            self.files[path] = data
+            return 200, {'content': self._content(path, data), 'commit': self._commit(body.get('message', ''))}
+    
+    def _delete_file(self, query, body, path):
+        with self.lock:
+            if path not in self.files:
+                return 404, {'message': 'file does not exist'}
+            if (body or {}).get('sha') != self._blob_sha(self.files[path]):
+                return 409, {'message': 'sha does not match'}
+            del self.files[path]
+            return 200, {'content': None, 'commit': self._commit(body.get('message', ''))}
+    
+    def _change_files(self, query, body):
+        with self.lock:
+            for change in body['files']:
+                path = change['path']
+                if change['operation'] == 'create' and path in self.files:
+                    return 422, {'message': f'repository file already exists [path: {path}]'}
+                if change['operation'] in ('update', 'delete'):
+                    if path not in self.files:
+                        return 404, {'message': f'file does not exist [path: {path}]'}
+                    if change.get('sha') != self._blob_sha(self.files[path]):
+                        return 409, {'message': f'sha does not match [path: {path}]'}
+            results = []
+            for change in body['files']:
+                path = change['path']
+                if change['operation'] == 'delete':
+                    del self.files[path]
+                    results.append(None)
+                else:
+                    data = base64.b64decode(change['content'])
+                    self.files[path] = data
+                    results.append(self._content(path, data))
+            return 201, {'files': results, 'commit': self._commit(body.get('message', ''))}
+
+class FakeOllama(FakeService):
+    """Ollama API: tags, generate, chat (обычный и потоковый режим)"""
+    
+    name = 'ollama'
+    
+    def __init__(self, models=('llama3.1',), tokens=40, token_latency=0.0, faults=None):
+        super().__init__(faults)
+        self.models = list(models)
+        self.tokens = tokens
+        self.token_latency = token_latency
+        self.route('GET', r'/api/tags', self._tags, 'tags')
+        self.route('POST', r'/api/generate', self._generate, 'generate')
+        self.route('POST', r'/api/chat', self._chat, 'chat')
+    
+    def _tags(self, query, body):
+        return 200, {'models': [{'name': name} for name in self.models]}
+    
+    def _text(self, body):
+        """Детерминированный ответ; при заданном format - JSON по схеме ревью"""
+        if body.get('format'):
+            return json.dumps({
+                'understanding': 'Задача понятна: синтетическая задача бенчмарка.',
+                'work_found': True,
+                'completion_status': 'выполнена',
+                'completion_assessment': 'Описанные шаги выполнены.',
+                'recommendations': '',
+                'verdict': 'Работа принята.'
+            }, ensure_ascii=False)
+        limit = min(self.tokens, (body.get('options') or {}).get('num_predict') or self.tokens)
+        return ' '.join(f"слово{i}" for i in range(limit))
+    
+    def _respond(self, body, wrap):
+        text = self._text(body)
+        words = text.split(' ')
+        eval_ns = int(max(self.token_latency, 1e-6) * len(words) * 1e9)
+        # Переданный context не вычисляется заново - считаем только новый промпт
+        prompt_tokens = len(json.dumps(dict(body, context=None), ensure_ascii=False)) // 4
+        final = {'done': True, 'done_reason': 'stop', 'eval_count': len(words),
+                 'eval_duration': eval_ns, 'prompt_eval_count': prompt_tokens}
+        if 'prompt' in body:
+            final['context'] = list(body.get('context') or []) + list(range(prompt_tokens + len(words)))
+        if not body.get('stream', True):
+            time.sleep(self.token_latency * len(words))
+            return 200, dict(wrap(text), **final)
+        
+        def chunks():
+            for i, word in enumerate(words):
+                if self.token_latency:
+                    time.sleep(self.token_latency)
+                piece = word if i == 0 else ' ' + word
+                yield (json.dumps(dict(wrap(piece), done=False), ensure_ascii=False) + '\n').encode('utf-8')
+            yield (json.dumps(dict(wrap(''), **final)) + '\n').encode('utf-8')
+        return 200, chunks()
+    
+    def _generate(self, query, body):
+        return self._respond(body, lambda text: {'model': body.get('model'), 'response': text})
+    
+    def _chat(self, query, body):
+        return self._respond(body, lambda text: {'model': body.get('model'),
+                                                 'message': {'role': 'assistant', 'content': text}})
@@ -0,0 +1,221 @@
+"""Герметичный бенчмарк агентов на локальных фейковых Jira, Gitea и Ollama.
+
+Запуск из каталога ai-host/agent:
+
+    python bench/run.py --issues 200 --latency 0.02 --output bench_results.json
+    python bench/run.py --issues 200 --baseline bench_results.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import contextlib
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FaultProfile, FakeJira, FakeGitea, FakeOllama
+from http_transport import HttpTransport
+from jira_client import JiraClient
+from gitea_git_client import GiteaGitClient
+from ai_client import AIClient
+from state_store import MemoryStateStore
+from jira_agent import JiraTaskAgent
+from review_agent import ReviewAgent
+from metrics import CLIENT_REQUESTS, CLIENT_ERRORS, CLIENT_LATENCY
+
+BENCH_USER = 'bench'
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark JiraTaskAgent and ReviewAgent against local fakes")
+    parser.add_argument('--issues', type=int, default=50, help="synthetic issues per scenario")
+    parser.add_argument('--comments', type=int, default=3, help="comments per In Review issue")
+    parser.add_argument('--rounds', type=int, default=3, help="measured rounds per scenario")
+    parser.add_argument('--scenarios', default='process_tasks,review_tasks')
+    parser.add_argument('--latency', type=float, default=0.005, help="per-request latency of Jira/Gitea, seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="latency jitter, seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of Jira/Gitea requests failing with 503")
+    parser.add_argument('--ai-latency', type=float, default=0.01, help="per-request latency of Ollama, seconds")
+    parser.add_argument('--ai-token-latency', type=float, default=0.0, help="per-token generation delay, seconds")
+    parser.add_argument('--ai-error-rate', type=float, default=0.0)
+    parser.add_argument('--embedded-comments', type=int, default=20, help="comments embedded in search results")
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--batch-commits', action='store_true')
+    parser.add_argument('--review-workers', type=int, default=1)
+    parser.add_argument('--ai-concurrency', type=int, default=1)
+    parser.add_argument('--combined-review', action='store_true')
+    parser.add_argument('--stream', action='store_true', help="use streaming Ollama responses")
+    parser.add_argument('--ai-sessions', action='store_true', help="reuse the task preamble context per issue")
+    parser.add_argument('--http-retries', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42, help="seed of fault injection")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="previous results file to compare against")
+    parser.add_argument('--verbose', action='store_true', help="show agent output")
+    return parser.parse_args(argv)
+
+def start_services(args):
+    def faults(latency, error_rate, salt):
+        return FaultProfile(latency=latency, jitter=args.jitter, error_rate=error_rate, seed=args.seed + salt)
+    
+    jira = FakeJira(embedded_comments=args.embedded_comments,
+                    faults=faults(args.latency, args.error_rate, 1)).start()
+    gitea = FakeGitea(faults=faults(args.latency, args.error_rate, 2)).start()
+    ollama = FakeOllama(token_latency=args.ai_token_latency,
+                        faults=faults(args.ai_latency, args.ai_error_rate, 3)).start()
+    return jira, gitea, ollama
+
+def build_clients(args, jira, gitea, ollama):
+    transport = HttpTransport(
+        pool_maxsize=max(10, args.review_workers * 2),
+        retries=args.http_retries,
+        backoff_factor=0.01
+    )
+    jira_client = JiraClient(jira.url, BENCH_USER, 'secret', jira.project_key,
+                             page_size=args.page_size, transport=transport)
+    git_client = GiteaGitClient(gitea.url, 'token', gitea.owner, gitea.repo,
+                                transport=transport, retry_base_delay=0.01)
+    ai_client = AIClient(ollama.url, stream=args.stream, transport=transport)
+    return transport, jira_client, git_client, ai_client
+
+def client_metrics():
+    """Снимок метрик клиентов: {client.method: (calls, errors, seconds)}"""
+    latency = CLIENT_LATENCY.values()
+    errors = CLIENT_ERRORS.values()
+    return {
+        f"{client}.{method}": (calls, errors.get((client, method), 0), latency[(client, method)]['sum'])
+        for (client, method), calls in CLIENT_REQUESTS.values().items()
+    }
+
+def metrics_delta(before, after):
+    delta = {}
+    for name, (calls, errors, seconds) in after.items():
+        prev_calls, prev_errors, prev_seconds = before.get(name, (0, 0, 0.0))
+        if calls == prev_calls:
+            continue
+        count = calls - prev_calls
+        delta[name] = {
+            'calls': count,
+            'errors': errors - prev_errors,
+            'mean_ms': round((seconds - prev_seconds) / count * 1000, 3)
+        }
+    return delta
+
+def run_scenario(name, args):
+    """Один измеряемый прогон сценария на свежих фейках"""
+    jira, gitea, ollama = start_services(args)
+    transport = None
+    try:
+        transport, jira_client, git_client, ai_client = build_clients(args, jira, gitea, ollama)
+        if name == 'process_tasks':
+            jira.seed(args.issues, 'In Progress', BENCH_USER)
+            agent = JiraTaskAgent(jira_client, git_client, BENCH_USER,
+                                  state_store=MemoryStateStore(), batch_commits=args.batch_commits)
+            cycle = agent.process_my_tasks
+        elif name == 'review_tasks':
+            jira.seed(args.issues, 'In Review', BENCH_USER, comments=args.comments)
+            agent = ReviewAgent(jira_client, ai_client, BENCH_USER, state_store=MemoryStateStore(),
+                                max_workers=args.review_workers, ai_concurrency=args.ai_concurrency,
+                                combined_review=args.combined_review, ai_sessions=args.ai_sessions)
+            cycle = agent.check_review_tasks
+        else:
+            raise ValueError(f"Unknown scenario: {name}")
+        
+        for service in (jira, gitea, ollama):
+            service.reset_counters()
+        before = client_metrics()
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            started = time.perf_counter()
+            cycle()
+            duration = time.perf_counter() - started
+        
+        result = {
+            'duration_s': round(duration, 4),
+            'tasks': args.issues,
+            'throughput_tasks_per_s': round(args.issues / duration, 2) if duration else None,
+            'upstream_requests': {service.name: dict(sorted(service.requests.items()))
+                                  for service in (jira, gitea, ollama)},
+            'client_calls': metrics_delta(before, client_metrics())
+        }
+        result['upstream_requests_total'] = sum(
+            sum(counts.values()) for counts in result['upstream_requests'].values()
+        )
+        if name == 'process_tasks':
+            result['gitea_commits'] = len(gitea.commits)
+            result['moved_to_review'] = sum(1 for issue in jira.issues.values() if issue['status'] == 'In Review')
+        return result
+    finally:
+        if transport:
+            transport.close()
+        for service in (jira, gitea, ollama):
+            service.stop()
+
+def summarize(rounds):
+    durations = [r['duration_s'] for r in rounds]
+    return {
+        'rounds': len(rounds),
+        'duration_s': {
+            'min': min(durations),
+            'median': round(statistics.median(durations), 4),
+            'max': max(durations)
+        },
+        'throughput_tasks_per_s': round(statistics.median(r['throughput_tasks_per_s'] or 0 for r in rounds), 2),
+        'upstream_requests_total': round(statistics.median(r['upstream_requests_total'] for r in rounds)),
+        'per_task_ms': round(statistics.median(durations) / rounds[0]['tasks'] * 1000, 3) if rounds[0]['tasks'] else None
+    }
+
+def compare(results, baseline):
+    """Сравнить медианы с прошлым прогоном"""
+    print("\n📊 Comparison with baseline:")
+    for name, scenario in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            print(f"   {name}: no baseline")
+            continue
+        current, previous = scenario['summary'], base['summary']
+        ratio = current['duration_s']['median'] / previous['duration_s']['median'] if previous['duration_s']['median'] else 0
+        requests_delta = current['upstream_requests_total'] - previous['upstream_requests_total']
+        marker = '🟢' if ratio <= 1.05 else '🔴'
+        print(f"   {marker} {name}: median {previous['duration_s']['median']}s -> {current['duration_s']['median']}s "
+              f"(x{ratio:.2f}), upstream requests {requests_delta:+d}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args)
+        },
+        'scenarios': {}
+    }
+    
+    for name in scenarios:
+        print(f"🏁 {name}: {args.issues} issues x {args.rounds} rounds")
+        # Прогревочный прогон не учитывается (импорты, первые соединения)
+        run_scenario(name, argparse.Namespace(**dict(vars(args), issues=min(args.issues, 5))))
+        rounds = []
+        for i in range(args.rounds):
+            result = run_scenario(name, args)
+            rounds.append(result)
+            print(f"   round {i + 1}: {result['duration_s']}s, {result['throughput_tasks_per_s']} tasks/s, "
+                  f"{result['upstream_requests_total']} upstream requests")
+        results['scenarios'][name] = {'rounds': rounds, 'summary': summarize(rounds)}
+    
+    with open(args.output, 'w') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"💾 Results saved to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    return results
+
+if __name__ == "__main__":
+    main()
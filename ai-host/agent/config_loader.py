@@ -2,6 +2,71 @@ import os
 import json
 from dotenv import load_dotenv
 
+def _env_bool(name, default=False):
+    """Прочитать булеву переменную окружения"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _env_keep_alive(name):
+    """keep_alive для Ollama: число секунд (-1 - не выгружать модель) или строка вида 30m"""
+    value = (os.getenv(name) or '').strip()
+    if not value:
+        return None
+    return int(value) if value.lstrip('-').isdigit() else value
+
+def _parse_projects(value):
+    """Пары проектов из строки вида: AL:admin/jira-sync, BE:admin/backend"""
+    projects = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        jira_project, _, repo = item.partition(':')
+        repo_owner, _, repo_name = repo.partition('/')
+        if not jira_project or not repo_owner or not repo_name:
+            raise ValueError(f"Invalid PROJECTS entry '{item}', expected JIRA_KEY:owner/repo")
+        projects.append({'jira_project': jira_project.strip(), 'repo_owner': repo_owner.strip(),
+                         'repo_name': repo_name.strip()})
+    return projects
+
+def _resolve_projects(config):
+    """Список пар "проект Jira -> репозиторий Gitea" с настройками по умолчанию.
+    
+    Без PROJECTS (и без "projects" в JSON) - одна пара из JIRA_PROJECT и
+    GITEA_REPO_*, как раньше, без ограничения запросов проектом.
+    """
+    projects = config['projects']
+    scoped = bool(projects)
+    if not projects:
+        projects = [{
+            'jira_project': config['jira']['project_key'],
+            'repo_owner': config['gitea']['repo_owner'],
+            'repo_name': config['gitea']['repo_name']
+        }]
+    
+    resolved = []
+    for project in projects:
+        entry = {
+            'name': (project.get('name') or project.get('jira_project') or 'default').lower(),
+            'jira_project': project.get('jira_project'),
+            'repo_owner': project.get('repo_owner') or config['gitea']['repo_owner'],
+            'repo_name': project.get('repo_name'),
+            'scoped': project.get('scoped', scoped),
+            'task_process_interval': config['agent']['task_process_interval'],
+            'review_interval': config['agent']['review_interval'],
+            'max_tasks_per_cycle': config['agent']['max_tasks_per_cycle'],
+            'batch_commits': config['gitea']['batch_commits']
+        }
+        entry.update({k: v for k, v in project.items() if k in entry and k != 'name'})
+        resolved.append(entry)
+    
+    names = [project['name'] for project in resolved]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate project names: {', '.join(names)}")
+    return resolved
+
 def load_config():
     """Загрузка всей конфигурации из .env и JSON"""
     
@@ -14,23 +79,97 @@ def load_config():
             'url': os.getenv('GITEA_URL'),
             'token': os.getenv('GITEA_TOKEN'),
             'repo_owner': os.getenv('GITEA_REPO_OWNER'),
-            'repo_name': os.getenv('GITEA_REPO_NAME')
+            'repo_name': os.getenv('GITEA_REPO_NAME'),
+            'batch_commits': _env_bool('GITEA_BATCH_COMMITS'),
+            'skip_unchanged': _env_bool('GITEA_SKIP_UNCHANGED', True),
+            'tree_index': _env_bool('GITEA_TREE_INDEX', True),
+            'write_retries': int(os.getenv('GITEA_WRITE_RETRIES', '3')),
+            'retry_max_delay': float(os.getenv('GITEA_RETRY_MAX_DELAY', '8'))
         },
         'jira': {
             'url': os.getenv('JIRA_URL'),
             'username': os.getenv('JIRA_USERNAME'),
             'password': os.getenv('JIRA_PASSWORD'),
             'project_key': os.getenv('JIRA_PROJECT'),
-            'agent_username': os.getenv('JIRA_AGENT_USERNAME', os.getenv('JIRA_USERNAME'))
+            'agent_username': os.getenv('JIRA_AGENT_USERNAME', os.getenv('JIRA_USERNAME')),
+            'page_size': int(os.getenv('JIRA_PAGE_SIZE', 50)),
+            'prefetch': _env_bool('JIRA_PREFETCH')
         },
         'ai': {
             'model_url': os.getenv('AI_MODEL_URL', 'http://localhost:11434'),
             'model_name': os.getenv('AI_MODEL_NAME', 'llama2'),
-            'temperature': float(os.getenv('AI_TEMPERATURE', 0.7))
+            'temperature': float(os.getenv('AI_TEMPERATURE', 0.7)),
+            'cache_enabled': _env_bool('AI_CACHE_ENABLED'),
+            'cache_size': int(os.getenv('AI_CACHE_SIZE', 256)),
+            'cache_disk_size': int(os.getenv('AI_CACHE_DISK_SIZE', 10000)),
+            'cache_ttl': int(os.getenv('AI_CACHE_TTL', 86400)),
+            'cache_persist': _env_bool('AI_CACHE_PERSIST', True),
+            'stream': _env_bool('AI_STREAM'),
+            'stream_timeout': int(os.getenv('AI_STREAM_TIMEOUT', 60)),
+            'prompt_budget': int(os.getenv('AI_PROMPT_BUDGET', 2048)),
+            'description_budget': int(os.getenv('AI_DESCRIPTION_BUDGET', 1024)),
+            'combined_max_tokens': int(os.getenv('AI_COMBINED_MAX_TOKENS', 1200)),
+            'num_ctx': int(os.getenv('AI_NUM_CTX', 0)),
+            'summarize_comments': _env_bool('AI_COMMENT_SUMMARY', True),
+            'summary_ttl': int(os.getenv('AI_COMMENT_SUMMARY_TTL', 604800)),
+            'keep_alive': _env_keep_alive('AI_KEEP_ALIVE'),
+            'sessions': _env_bool('AI_SESSIONS'),
+            'session_limit': int(os.getenv('AI_SESSION_LIMIT', 64)),
+            'session_max_tokens': int(os.getenv('AI_SESSION_MAX_TOKENS', 2048))
         },
         'agent': {
-            'task_process_interval': int(os.getenv('TASK_PROCESS_INTERVAL', 120))
-        }
+            'task_process_interval': int(os.getenv('TASK_PROCESS_INTERVAL', 120)),
+            'review_interval': int(os.getenv('REVIEW_INTERVAL', 60)),
+            'max_tasks_per_cycle': int(os.getenv('PROJECT_MAX_TASKS_PER_CYCLE', 0)),
+            'review_workers': int(os.getenv('REVIEW_WORKERS', 1)),
+            'review_jira_concurrency': int(os.getenv('REVIEW_JIRA_CONCURRENCY', 4)),
+            'ollama_num_parallel': int(os.getenv('OLLAMA_NUM_PARALLEL', 1)),
+            'combined_review': _env_bool('REVIEW_COMBINED'),
+            'status_interval': int(os.getenv('REPOSITORY_STATUS_INTERVAL', 300)),
+            'schedule_jitter': float(os.getenv('SCHEDULE_JITTER', 0.1)),
+            'runtime_threads': int(os.getenv('RUNTIME_THREADS', 8)),
+            'shutdown_timeout': int(os.getenv('SHUTDOWN_TIMEOUT', 30)),
+            'metrics_enabled': _env_bool('METRICS_ENABLED'),
+            'metrics_host': os.getenv('METRICS_HOST', '0.0.0.0'),
+            'metrics_port': int(os.getenv('METRICS_PORT', 9100)),
+            'queue_capacity': int(os.getenv('WORK_QUEUE_CAPACITY', 1000)),
+            'queue_batch': int(os.getenv('WORK_QUEUE_BATCH', 50)),
+            'queue_drain_interval': int(os.getenv('WORK_QUEUE_DRAIN_INTERVAL', 15)),
+            'retry_attempts': int(os.getenv('TASK_RETRY_ATTEMPTS', 3)),
+            'retry_delay': int(os.getenv('TASK_RETRY_DELAY', 60))
+        },
+        'http': {
+            'pool_size': int(os.getenv('HTTP_POOL_SIZE', 10)),
+            'timeout': int(os.getenv('HTTP_TIMEOUT', 30)),
+            'retries': int(os.getenv('HTTP_RETRIES', 3)),
+            'backoff': float(os.getenv('HTTP_BACKOFF', 0.5)),
+            'health_ttl': int(os.getenv('HEALTH_TTL', 60)),
+            'circuit_failure_threshold': int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5)),
+            'circuit_reset_timeout': int(os.getenv('CIRCUIT_RESET_TIMEOUT', 60))
+        },
+        'sharding': {
+            'backend': os.getenv('SHARD_BACKEND', 'none'),
+            'worker_id': os.getenv('WORKER_ID'),
+            'lease_ttl': int(os.getenv('SHARD_LEASE_TTL', 60))
+        },
+        'webhooks': {
+            'enabled': _env_bool('WEBHOOKS_ENABLED'),
+            'host': os.getenv('WEBHOOK_HOST', '127.0.0.1'),
+            'port': int(os.getenv('WEBHOOK_PORT', 8085)),
+            'jira_secret': os.getenv('JIRA_WEBHOOK_SECRET'),
+            'gitea_secret': os.getenv('GITEA_WEBHOOK_SECRET'),
+            'reconcile_interval': int(os.getenv('WEBHOOK_RECONCILE_INTERVAL', 900)),
+            'batch_window': float(os.getenv('WEBHOOK_BATCH_WINDOW', 1.0))
+        },
+        'sync': {
+            'state_dir': os.getenv('STATE_DIR', '/app/state'),
+            'incremental': _env_bool('JIRA_INCREMENTAL_SYNC'),
+            'full_sync_interval': int(os.getenv('JIRA_FULL_SYNC_INTERVAL', 3600)),
+            'state_backend': os.getenv('STATE_BACKEND', 'sqlite'),
+            'processed_ttl': int(os.getenv('PROCESSED_TASK_TTL', 86400))
+        },
+        # Несколько пар "проект Jira -> репозиторий Gitea" в одном процессе
+        'projects': _parse_projects(os.getenv('PROJECTS'))
     }
     
     # Загружаем JSON конфиг если существует
@@ -49,6 +188,16 @@ def load_config():
                 config['ai'].update(json_config['ai'])
             if 'agent' in json_config:
                 config['agent'].update(json_config['agent'])
+            if 'http' in json_config:
+                config['http'].update(json_config['http'])
+            if 'sharding' in json_config:
+                config['sharding'].update(json_config['sharding'])
+            if 'webhooks' in json_config:
+                config['webhooks'].update(json_config['webhooks'])
+            if 'sync' in json_config:
+                config['sync'].update(json_config['sync'])
+            if 'projects' in json_config:
+                config['projects'] = json_config['projects']
                 
             print("✅ Loaded JSON configuration")
         except Exception as e:
@@ -73,11 +222,22 @@ def load_config():
     if missing_fields:
         raise ValueError(f"Missing required environment variables: {', '.join(missing_fields)}")
     
+    # Приемник вебхуков снаружи хоста принимает события только с подписью
+    webhooks = config['webhooks']
+    if webhooks['enabled'] and webhooks['host'] not in ('127.0.0.1', 'localhost', '::1'):
+        if not webhooks['jira_secret'] or not webhooks['gitea_secret']:
+            raise ValueError(
+                f"WEBHOOK_HOST={webhooks['host']} requires JIRA_WEBHOOK_SECRET and GITEA_WEBHOOK_SECRET "
+                f"(or WEBHOOK_HOST=127.0.0.1 behind a proxy)"
+            )
+    
+    config['projects'] = _resolve_projects(config)
+    
     print(f"✅ Configuration loaded:")
     print(f"   Jira: {config['jira']['url']}")
-    print(f"   Jira Project: {config['jira']['project_key']}")
     print(f"   Agent Username: {config['jira']['agent_username']}")
-    print(f"   Gitea Repo: {config['gitea']['repo_owner']}/{config['gitea']['repo_name']}")
+    for project in config['projects']:
+        print(f"   Project {project['jira_project']} -> Gitea Repo: {project['repo_owner']}/{project['repo_name']}")
     print(f"   AI Model: {config['ai']['model_url']}")
     
     return config
\ No newline at end of file
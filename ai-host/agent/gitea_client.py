@@ -1,7 +1,7 @@
-import requests
+from http_transport import HttpTransport
 
 class GiteaClient:
-    def __init__(self, url, token, repo_owner, repo_name):
+    def __init__(self, url, token, repo_owner, repo_name, transport=None):
         self.url = url
         self.repo_owner = repo_owner
         self.repo_name = repo_name
@@ -9,11 +9,12 @@ class GiteaClient:
             'Authorization': f'token {token}',
             'Content-Type': 'application/json'
         }
+        self.session = (transport or HttpTransport()).session(headers=self.headers, service='gitea')
     
     def health_check(self):
         """Проверка доступности Gitea"""
         try:
-            response = requests.get(f"{self.url}/api/v1/user", headers=self.headers, timeout=10)
+            response = self.session.get(f"{self.url}/api/v1/user", timeout=10)
             if response.status_code == 200:
                 user_info = response.json()
                 return True, f"Gitea OK (user: {user_info.get('login')})"
@@ -26,7 +27,7 @@ class GiteaClient:
         """Создать репозиторий если не существует"""
         try:
             check_url = f"{self.url}/api/v1/repos/{self.repo_owner}/{self.repo_name}"
-            response = requests.get(check_url, headers=self.headers)
+            response = self.session.get(check_url)
             
             if response.status_code == 200:
                 return True, "Repository exists"
@@ -39,7 +40,7 @@ class GiteaClient:
                     'auto_init': True
                 }
                 
-                response = requests.post(create_url, headers=self.headers, json=repo_data)
+                response = self.session.post(create_url, json=repo_data)
                 if response.status_code == 201:
                     return True, "Repository created"
                 else:
@@ -80,7 +81,7 @@ class GiteaClient:
                 'body': body.strip()
             }
             
-            response = requests.post(url, headers=self.headers, json=issue_data)
+            response = self.session.post(url, json=issue_data)
             
             if response.status_code == 201:
                 return True, f"Issue {issue_key} created"
@@ -98,7 +99,7 @@ class GiteaClient:
             url = f"{self.url}/api/v1/repos/{self.repo_owner}/{self.repo_name}/issues"
             params = {'state': 'all'}
             
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self.session.get(url, params=params)
             if response.status_code == 200:
                 issues = response.json()
                 return True, issues
@@ -0,0 +1,150 @@
+import time
+import threading
+from requests import RequestException
+
+class CircuitOpenError(RequestException):
+    """Запрос не отправлен: предохранитель сервиса разомкнут"""
+
+class ServiceHealth:
+    """Состояние одного внешнего сервиса"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name, probe=None):
+        self.name = name
+        self.probe = probe
+        self.state = self.CLOSED
+        self.ok = None
+        self.message = "not checked yet"
+        self.checked_at = None
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+class HealthRegistry:
+    """Кэш доступности сервисов с предохранителями (circuit breaker).
+    
+    Статус обновляется пассивно по исходу обычных запросов клиентов и только
+    при устаревании (старше ttl) - активной проверкой. После failure_threshold
+    ошибок подряд предохранитель размыкается: запросы к сервису не отправляются
+    reset_timeout секунд, затем пропускается один пробный запрос.
+    """
+    
+    def __init__(self, ttl=60, failure_threshold=5, reset_timeout=60):
+        self.ttl = ttl
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._services = {}
+        self._lock = threading.Lock()
+    
+    def register(self, name, probe=None):
+        """Зарегистрировать сервис; probe() -> (ok, message) - активная проверка"""
+        with self._lock:
+            service = self._services.get(name)
+            if service is None:
+                service = self._services[name] = ServiceHealth(name, probe)
+            elif probe is not None:
+                service.probe = probe
+        return service
+    
+    def allow_request(self, name):
+        """Можно ли отправить запрос к сервису (не разомкнут ли предохранитель)"""
+        with self._lock:
+            service = self._services.get(name)
+            if service is None or service.state == ServiceHealth.CLOSED:
+                return True
+            if service.state == ServiceHealth.OPEN:
+                if time.time() - service.opened_at < self.reset_timeout:
+                    return False
+                service.state = ServiceHealth.HALF_OPEN
+            # Полуоткрытое состояние - пропускаем только один пробный запрос
+            if service.trial_in_flight:
+                return False
+            service.trial_in_flight = True
+            return True
+    
+    def release_trial(self, name):
+        """Освободить пробный запрос, исход которого неизвестен"""
+        with self._lock:
+            service = self._services.get(name)
+            if service is not None:
+                service.trial_in_flight = False
+    
+    def record_success(self, name, message="OK"):
+        """Учесть успешный запрос к сервису"""
+        with self._lock:
+            service = self._services.get(name)
+            if service is None:
+                return
+            if service.state != ServiceHealth.CLOSED:
+                print(f"🟢 {name}: service recovered, circuit closed")
+            service.state = ServiceHealth.CLOSED
+            service.ok = True
+            service.message = message
+            service.checked_at = time.time()
+            service.consecutive_failures = 0
+            service.trial_in_flight = False
+    
+    def record_failure(self, name, message):
+        """Учесть неудачный запрос к сервису"""
+        with self._lock:
+            service = self._services.get(name)
+            if service is None:
+                return
+            now = time.time()
+            service.ok = False
+            service.message = message
+            service.checked_at = now
+            service.consecutive_failures += 1
+            service.trial_in_flight = False
+            if service.state == ServiceHealth.HALF_OPEN or (
+                service.state == ServiceHealth.CLOSED
+                and service.consecutive_failures >= self.failure_threshold
+            ):
+                if service.state == ServiceHealth.CLOSED:
+                    print(f"🔴 {name}: {service.consecutive_failures} failures in a row, "
+                          f"circuit open for {self.reset_timeout}s")
+                service.state = ServiceHealth.OPEN
+                service.opened_at = now
+    
+    def check(self, name):
+        """Доступен ли сервис: из кэша, если статус свежий, иначе активной проверкой"""
+        with self._lock:
+            service = self._services.get(name)
+            if service is None:
+                return True, "not monitored"
+            fresh = service.checked_at is not None and time.time() - service.checked_at < self.ttl
+            if service.state == ServiceHealth.OPEN:
+                remaining = self.reset_timeout - (time.time() - service.opened_at)
+                if remaining > 0:
+                    return False, f"circuit open ({int(remaining)}s left): {service.message}"
+            elif fresh:
+                return service.ok, f"{service.message} (cached)"
+            probe = service.probe
+        
+        if probe is None:
+            return True, "no probe"
+        ok, message = probe()
+        # Счетчик ошибок предохранителя уже обновлен пассивно запросом проверки,
+        # здесь только запоминаем ее вывод (например, 401 - сервис жив, но недоступен нам)
+        with self._lock:
+            service.ok = ok
+            service.message = message
+            service.checked_at = time.time()
+        return ok, message
+    
+    def snapshot(self):
+        """Текущее состояние всех сервисов"""
+        with self._lock:
+            return {
+                name: {
+                    'ok': service.ok,
+                    'state': service.state,
+                    'message': service.message,
+                    'checked_at': service.checked_at,
+                    'consecutive_failures': service.consecutive_failures
+                }
+                for name, service in self._services.items()
+            }
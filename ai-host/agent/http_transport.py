@@ -0,0 +1,98 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from health import CircuitOpenError
+
+class TransportSession(requests.Session):
+    """Сессия поверх общего транспорта с таймаутом по умолчанию.
+    
+    Если задан реестр здоровья, исход каждого запроса учитывается в статусе сервиса,
+    а при разомкнутом предохранителе запрос не отправляется (CircuitOpenError).
+    """
+    
+    # Ответы, означающие проблему на стороне сервиса (после всех повторов адаптера)
+    FAILURE_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(self, default_timeout=None, health=None, service=None):
+        super().__init__()
+        self.default_timeout = default_timeout
+        self.health = health if service else None
+        self.service = service
+    
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.default_timeout
+        if self.health is None:
+            return super().request(method, url, **kwargs)
+        
+        if not self.health.allow_request(self.service):
+            raise CircuitOpenError(f"{self.service} is unavailable (circuit open)")
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.RequestException as e:
+            self.health.record_failure(self.service, f"request failed: {e}")
+            raise
+        except BaseException:
+            # Исход неизвестен - освобождаем пробный запрос, не меняя счетчиков
+            self.health.release_trial(self.service)
+            raise
+        if response.status_code in self.FAILURE_STATUSES:
+            self.health.record_failure(self.service, f"HTTP {response.status_code}")
+        else:
+            self.health.record_success(self.service, f"HTTP {response.status_code}")
+        return response
+
+class HttpTransport:
+    """Общий HTTP-транспорт: пулы keep-alive соединений по хостам, таймауты и повторы"""
+    
+    # Адаптер повторяет только чтение. Запись (POST, PUT, DELETE) не дублируем:
+    # коммиты Gitea клиент повторяет сам, с учетом конфликтов и backoff
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'TRACE'])
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(self, pool_connections=10, pool_maxsize=10, timeout=30, retries=3, backoff_factor=0.5,
+                 health=None):
+        self.timeout = timeout
+        # Реестр здоровья сервисов (пассивные обновления и предохранители), опционально
+        self.health = health
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=self.IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        # Один адаптер на все сессии: пулы соединений общие для всех клиентов,
+        # pool_connections - число хостов, pool_maxsize - соединений на хост
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry
+        )
+    
+    def session(self, headers=None, auth=None, timeout=None, service=None):
+        """Создать сессию клиента со своими заголовками/авторизацией поверх общих пулов.
+        
+        Все клиенты (Jira, Gitea, AI) берут соединения из общего пула транспорта:
+        keep-alive, таймаут по умолчанию и повторы чтения.
+        
+        service - имя сервиса в реестре здоровья (jira, gitea, ai).
+        """
+        if service and self.health:
+            self.health.register(service)
+        session = TransportSession(default_timeout=timeout or self.timeout, health=self.health, service=service)
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        if headers:
+            session.headers.update(headers)
+        if auth:
+            session.auth = auth
+        return session
+    
+    def close(self):
+        """Закрыть все соединения"""
+        self.adapter.close()
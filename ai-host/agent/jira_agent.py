@@ -1,41 +1,189 @@
 import time
 import os
+import threading
 from datetime import datetime
+from jira_client import JiraSearchError, is_issue_key
 from jira_tasks import JiraTasks
+from state_store import MemoryStateStore, fingerprint
+from metrics import record_cycle
+from sharding import ShardCoordinator
+from work_queue import WorkQueue, issue_priority, PRIORITY_EVENT, PRIORITY_POLL
 
 class JiraTaskAgent:
-    def __init__(self, jira_client, gitea_git_client, username):
+    STATE_NAMESPACE = 'processed_tasks'
+    METRICS_NAME = 'task_agent'
+    # Строки файла задачи, которые меняются без изменения самой задачи
+    VOLATILE_PATTERNS = [r'^## Дата обновления:']
+    
+    def __init__(self, jira_client, gitea_git_client, username, sync=None,
+                 state_store=None, processed_ttl=86400, batch_commits=False,
+                 queue_capacity=1000, queue_batch=50, retry_attempts=3, retry_delay=60,
+                 shard=None, name=None, max_tasks_per_cycle=0):
         self.tasks = JiraTasks(jira_client)
         self.git = gitea_git_client
         self.username = username
-        self.processed_tasks = set()
+        self.sync = sync
+        # Обработанные задачи: ключ задачи + отпечаток значимых полей, с TTL
+        self.state = state_store or MemoryStateStore()
+        self.processed_ttl = processed_ttl
+        # Все файлы цикла одним коммитом вместо коммита на каждую задачу
+        self.batch_commits = batch_commits
+        # Опрос по расписанию и обработка событий не должны идти одновременно
+        self._cycle_lock = threading.Lock()
+        # Очередь работы: опрос, события и повторы сливаются в одну запись на задачу
+        # Имя проекта в метриках, когда в процессе несколько проектов
+        self.metrics_name = f"{self.METRICS_NAME}:{name}" if name else self.METRICS_NAME
+        self.max_tasks_per_cycle = max_tasks_per_cycle
+        self.queue = WorkQueue(self.metrics_name, capacity=queue_capacity,
+                               max_attempts=retry_attempts, retry_delay=retry_delay)
+        self.queue_batch = queue_batch
+        # При нескольких воркерах каждая задача принадлежит ровно одному из них
+        self.shard = shard or ShardCoordinator()
     
     def process_my_tasks(self):
         """Обработать задачи назначенные на меня в статусе In Progress"""
         print(f"\n🔍 Checking In Progress tasks for {self.username}...")
         
-        # Получаем задачи в статусе In Progress
-        success, result = self.tasks.get_my_in_progress_tasks(self.username)
-        
-        if not success:
-            print(f"❌ Error getting tasks: {result}")
+        # Получаем задачи в статусе In Progress.
+        # Обработанные задачи уходят из In Progress, поэтому сначала выбираем
+        # все страницы целиком - иначе смещение startAt пропустило бы часть задач
+        try:
+            tasks = list(self.tasks.iter_my_in_progress_tasks(self.username, sync=self.sync))
+        except JiraSearchError as e:
+            print(f"❌ Error getting tasks: {e}")
+            record_cycle(self.metrics_name, 0)
             return
         
-        tasks = result
         print(f"📋 Found {len(tasks)} tasks in In Progress")
-        
         if not tasks:
             print("😴 No In Progress tasks to process")
+        
+        cycle = {'processed': 0}
+        try:
+            queued, rejected = self._enqueue(tasks, PRIORITY_POLL, cycle)
+            cycle['processed'] += self.drain_queue(self.max_tasks_per_cycle)
+        finally:
+            # Итог пишем раз за цикл, в том числе пустой - иначе метрика хранила бы прошлый цикл
+            record_cycle(self.metrics_name, cycle['processed'])
+        # Водяной знак двигаем, только когда все найденные задачи обработаны:
+        # иначе отложенные задачи не попадут в следующую выборку до их изменения
+        if rejected or self.queue.has_pending(queued):
+            print("⏳ Some tasks are left for the next cycle, sync watermark is kept")
+        else:
+            self._commit_sync()
+        
+        if tasks:
+            print(f"✅ Processed {cycle['processed']} of {len(tasks)} In Progress tasks")
+    
+    def process_task_keys(self, keys):
+        """Обработать задачи по событию (вебхуку): только указанные ключи, если они In Progress"""
+        keys = sorted(key for key in set(keys) if is_issue_key(key))
+        if not keys:
+            return 0
+        print(f"\n⚡ Event-driven check of {len(keys)} tasks: {', '.join(keys[:10])}")
+        
+        try:
+            tasks = list(self.tasks.iter_my_in_progress_tasks_by_keys(self.username, keys))
+        except JiraSearchError as e:
+            print(f"❌ Error getting tasks: {e}")
+            record_cycle(self.metrics_name, 0)
+            return 0
+        
+        if not tasks:
+            print("😴 None of them is In Progress for me")
+        cycle = {'processed': 0}
+        try:
+            self._enqueue(tasks, PRIORITY_EVENT, cycle)
+            cycle['processed'] += self.drain_queue(self.max_tasks_per_cycle)
+        finally:
+            record_cycle(self.metrics_name, cycle['processed'])
+        return cycle['processed']
+    
+    def _enqueue(self, tasks, level, cycle):
+        """Поставить задачи в очередь; повторная постановка ключа лишь обновляет запись.
+        
+        Задачи, обработанные при разгрузке заполненной очереди, добавляются в cycle['processed'].
+        Возвращает (поставленные ключи, число не поместившихся задач).
+        """
+        queued = []
+        rejected = 0
+        for task in tasks:
+            if not self.shard.owns(task['key']):
+                continue
+            priority = issue_priority(task, level)
+            if not self.queue.put(task['key'], task, priority):
+                # Очередь заполнена - сначала разгружаем ее
+                cycle['processed'] += self.drain_queue(self.max_tasks_per_cycle)
+                if not self.queue.put(task['key'], task, priority, block=True, timeout=60):
+                    print(f"⚠️  Work queue is full, {task['key']} is left for the next cycle")
+                    rejected += 1
+                    continue
+            queued.append(task['key'])
+        return queued, rejected
+    
+    def drain_queue(self, limit=None, wait=True):
+        """Обработать готовые задачи из очереди пачками (не больше limit), вернуть число обработанных.
+        
+        wait=False - не ждать, если агент уже занят циклом (вернуть 0).
+        """
+        processed = 0
+        taken = 0
+        if not self._cycle_lock.acquire(blocking=wait):
+            return 0
+        try:
+            # limit - справедливость между проектами: остаток дождется следующего прохода
+            while not limit or taken < limit:
+                batch = self.queue.get_batch(min(self.queue_batch, limit - taken) if limit else self.queue_batch)
+                if not batch:
+                    break
+                taken += len(batch)
+                # Задачи, которые после перебалансировки достались другому воркеру, пропускаем
+                claimed = self.shard.claim(key for key, _, _ in batch)
+                try:
+                    processed += self._process_tasks([entry for entry in batch if entry[0] in claimed])
+                finally:
+                    # Ключи, исход которых не зафиксирован (например, из-за исключения), освобождаем
+                    for key, _, _ in batch:
+                        self.queue.done(key)
+                    self.shard.release(claimed)
+        finally:
+            self._cycle_lock.release()
+        
+        return processed
+    
+    def _finish_task(self, task, task_fingerprint, ok, attempts):
+        """Зафиксировать исход задачи: отметить обработанной или отложить повтор"""
+        task_key = task['key']
+        if not ok and self.queue.retry(task_key, task, attempts):
+            print(f"   🔁 {task_key}: retry {attempts + 1} scheduled")
             return
+        self.queue.done(task_key)
+        # Помечаем как обработанную (переживает перезапуск при SQLite-хранилище);
+        # после исчерпания повторов - тоже, до следующего изменения задачи
+        self.state.put(self.STATE_NAMESPACE, task_key, task_fingerprint, ttl=self.processed_ttl)
+    
+    def _process_tasks(self, batch):
+        """Обработать пачку из очереди [(key, task, attempts)], вернуть число реально обработанных"""
+        if not batch:
+            return 0
+        
+        # Один запрос head ветки (и дерева, если ветку меняли) вместо поиска sha по каждому файлу
+        self.git.refresh_tree_index("main")
+        
+        if self.batch_commits:
+            return self._process_tasks_batched(batch)
         
         # Обрабатываем каждую задачу
-        for task in tasks:
-            task_key = task['key']
+        processed = 0
+        for task_key, task, attempts in batch:
+            task_fingerprint = self._task_fingerprint(task)
             
-            # Пропускаем уже обработанные задачи в этой сессии
-            if task_key in self.processed_tasks:
-                print(f"⏭️  Already processed in this session: {task_key}")
+            # Пропускаем уже обработанные задачи, если значимые поля не менялись
+            if self.state.is_current(self.STATE_NAMESPACE, task_key, task_fingerprint):
+                print(f"⏭️  Already processed: {task_key}")
+                self.queue.done(task_key)
                 continue
+            processed += 1
             
             print(f"\n🎯 Processing In Progress task: {task_key}")
             print(f"   Summary: {task['fields']['summary']}")
@@ -48,25 +196,84 @@ class JiraTaskAgent:
                 self._add_work_comment(task_key)
                 
                 # Переводим задачу в статус In Review
-                self._move_to_in_review(task_key)
+                self._move_to_in_review(task)
             
-            # Помечаем как обработанную в этой сессии
-            self.processed_tasks.add(task_key)
+            self._finish_task(task, task_fingerprint, file_processed, attempts)
         
-        print(f"✅ Processed {len(tasks)} In Progress tasks")
+        return processed
     
-    def _create_task_file(self, task):
-        """Создать или обновить файл задачи в репозитории"""
+    def _process_tasks_batched(self, batch):
+        """Обработать пачку задач с записью всех файлов одним коммитом"""
+        pending = []
+        self.git.begin_batch(branch="main")
+        for task_key, task, attempts in batch:
+            task_fingerprint = self._task_fingerprint(task)
+            
+            if self.state.is_current(self.STATE_NAMESPACE, task_key, task_fingerprint):
+                print(f"⏭️  Already processed: {task_key}")
+                self.queue.done(task_key)
+                continue
+            
+            print(f"\n🎯 Queued In Progress task: {task_key}")
+            print(f"   Summary: {task['fields']['summary']}")
+            try:
+                filename, file_content, _ = self._build_task_file(task)
+            except Exception as e:
+                print(f"   ❌ Error preparing file for task {task_key}: {e}")
+                self._finish_task(task, task_fingerprint, False, attempts)
+                continue
+            self.git.add_to_batch(filename, file_content, volatile_patterns=self.VOLATILE_PATTERNS)
+            pending.append((task, task_fingerprint, filename, attempts))
+        
+        if not pending:
+            self.git.discard_batch()
+            return 0
+        
+        keys = ', '.join(task['key'] for task, _, _, _ in pending[:10])
+        if len(pending) > 10:
+            keys += f" and {len(pending) - 10} more"
+        commit_message = f"🤖 Update task files for {len(pending)} tasks: {keys}"
+        success, results = self.git.commit_batch(commit_message)
+        print(f"   {'✅' if success else '⚠️ '} Batch commit: "
+              f"{sum(1 for ok, _ in results.values() if ok)}/{len(pending)} files written")
+        
+        # Комментарии и переходы - только для задач, чьи файлы записаны
+        for task, task_fingerprint, filename, attempts in pending:
+            task_key = task['key']
+            ok, message = results.get(filename, (False, "No result for file"))
+            print(f"\n   {'✅' if ok else '❌'} {task_key}: {message}")
+            if ok:
+                self._add_work_comment(task_key)
+                self._move_to_in_review(task)
+            self._finish_task(task, task_fingerprint, ok, attempts)
+        return len(pending)
+    
+    def _commit_sync(self):
+        """Зафиксировать водяной знак инкрементальной синхронизации"""
+        if self.sync:
+            self.sync.commit(self.tasks.in_progress_sync_name(self.username))
+    
+    def _task_fingerprint(self, task):
+        """Отпечаток полей задачи, влияющих на файл в репозитории"""
+        fields = task['fields']
+        return fingerprint(
+            fields.get('summary'),
+            fields.get('description'),
+            (fields.get('status') or {}).get('name'),
+            self.username
+        )
+    
+    def _build_task_file(self, task):
+        """Сформировать имя, содержимое и сообщение коммита для файла задачи"""
         task_key = task['key']
         task_summary = task['fields']['summary']
         task_description = task['fields'].get('description', 'No description provided')
         
-        try:
-            # Формируем имя файла - точно как ключ задачи (AL-2 -> al-2.txt)
-            filename = f"{task_key.lower()}.txt"
-            
-            # Формируем содержимое файла
-            file_content = f"""# Задача: {task_key}
+        # Формируем имя файла - точно как ключ задачи (AL-2 -> al-2.txt)
+        filename = f"{task_key.lower()}.txt"
+        
+        # Формируем содержимое файла
+        file_content = f"""# Задача: {task_key}
 
 ## Название: {task_summary}
 
@@ -80,36 +287,32 @@ class JiraTaskAgent:
 ---
 *Автоматически создано/обновлено агентом Jira-Gitea Sync*
 """
-            # Создаем или обновляем файл в репозитории
-            commit_message = f"🤖 Update task file for {task_key}: {task_summary}"
+        commit_message = f"🤖 Update task file for {task_key}: {task_summary}"
+        return filename, file_content.strip(), commit_message
+    
+    def _create_task_file(self, task):
+        """Создать или обновить файл задачи в репозитории"""
+        task_key = task['key']
+        
+        try:
+            filename, file_content, commit_message = self._build_task_file(task)
             
-            # Пробуем обычное обновление
+            # Создаем или обновляем файл в репозитории
             success, message = self.git.create_or_update_file(
                 file_path=filename,
-                content=file_content.strip(),
+                content=file_content,
                 commit_message=commit_message,
-                branch="main"
+                branch="main",
+                volatile_patterns=self.VOLATILE_PATTERNS
             )
             
+            # Конфликты версий клиент уже разрешил повторами с актуальным sha
             if success:
                 print(f"   ✅ {message}")
                 return True
             else:
-                # Если не получилось, пробуем принудительное обновление
-                print(f"   ⚠️  Regular update failed, trying force update...")
-                success, message = self.git.force_update_file(
-                    file_path=filename,
-                    content=file_content.strip(),
-                    commit_message=commit_message,
-                    branch="main"
-                )
-                
-                if success:
-                    print(f"   ✅ {message}")
-                    return True
-                else:
-                    print(f"   ❌ {message}")
-                    return False
+                print(f"   ❌ {message}")
+                return False
                 
         except Exception as e:
             print(f"   ❌ Error processing file for task {task_key}: {e}")
@@ -136,28 +339,21 @@ class JiraTaskAgent:
         except Exception as e:
             print(f"   ❌ Error adding comment: {e}")
     
-    def _move_to_in_review(self, task_key):
+    def _move_to_in_review(self, task):
         """Перевести задачу в статус In Review"""
         try:
-            success, message = self.tasks.transition_task(task_key, "In Review")
+            # Если перехода "In Review" нет, подойдет "Review" - одним вызовом
+            success, message = self.tasks.transition_task(task['key'], ["In Review", "Review"], issue=task)
             
             if success:
                 print(f"   🔄 {message}")
             else:
-                # Если статус "In Review" не найден, пробуем "Review"
-                if "not found" in message.lower():
-                    success, message = self.tasks.transition_task(task_key, "Review")
-                    if success:
-                        print(f"   🔄 {message}")
-                    else:
-                        print(f"   ⚠️  {message}")
-                else:
-                    print(f"   ⚠️  {message}")
+                print(f"   ⚠️  {message}")
                     
         except Exception as e:
             print(f"   ❌ Error moving task to In Review: {e}")
     
     def clear_processed_cache(self):
-        """Очистить кэш обработанных задач"""
-        self.processed_tasks.clear()
-        print("🧹 Cleared processed tasks cache")
\ No newline at end of file
+        """Удалить из хранилища все записи с истекшим TTL (обработанные задачи, резюме комментариев)"""
+        purged = self.state.purge_expired()
+        print(f"🧹 Purged {purged} expired state records")
\ No newline at end of file
@@ -1,12 +1,36 @@
-import requests
+import re
+from http_transport import HttpTransport
+from metrics import instrumented
+from concurrent.futures import ThreadPoolExecutor
+
+class JiraSearchError(Exception):
+    """Ошибка поиска задач в Jira"""
+
+# Ключ задачи Jira: ключ проекта и номер (AL-12)
+ISSUE_KEY_RE = re.compile(r'^[A-Z][A-Z0-9_]+-\d+$')
+
+def is_issue_key(value):
+    """Похоже ли значение на ключ задачи Jira"""
+    return isinstance(value, str) and bool(ISSUE_KEY_RE.match(value))
+
+def jql_key_list(keys):
+    """Список ключей для "key in (...)": только корректные ключи, каждый в кавычках"""
+    return ', '.join(f'"{key}"' for key in keys if is_issue_key(key))
 
 class JiraClient:
-    def __init__(self, url, username, password, project_key):
+    ISSUE_FIELDS = 'key,summary,description,status,assignee,created,updated,issuetype,project'
+    
+    def __init__(self, url, username, password, project_key, page_size=50, prefetch=False,
+                 transport=None, scope_project=False):
         self.url = url
         self.project_key = project_key
-        self.session = requests.Session()
-        self.session.auth = (username, password)
+        # Ограничивать все поиски проектом клиента (несколько проектов в одном процессе)
+        self.scope_project = scope_project
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.session = (transport or HttpTransport()).session(auth=(username, password), service='jira')
     
+    @instrumented('jira')
     def health_check(self):
         """Проверка доступности Jira"""
         try:
@@ -19,30 +43,123 @@ class JiraClient:
         except Exception as e:
             return False, f"Jira connection failed: {e}"
     
-    def get_issues(self, jql=None, max_results=10):
-        """Получить задачи из Jira"""
+    @instrumented('jira')
+    def get_user_timezone(self):
+        """Часовой пояс профиля пользователя Jira (IANA, например Europe/Moscow) или None"""
         try:
-            if not jql:
-                jql = f"project = {self.project_key}"
-            
-            url = f"{self.url}/rest/api/2/search"
-            params = {
-                'jql': jql,
-                'maxResults': max_results,
-                'fields': 'key,summary,description,status,assignee,created'
-            }
-            
-            response = self.session.get(url, params=params)
+            response = self.session.get(f"{self.url}/rest/api/2/myself", timeout=10)
             if response.status_code == 200:
-                data = response.json()
+                return response.json().get('timeZone')
+        except Exception as e:
+            print(f"⚠️  Could not get Jira user time zone: {e}")
+        return None
+    
+    @instrumented('jira', method='search')
+    def _search_page(self, jql, start_at, page_size, fields=None, validate_query=None):
+        """Получить одну страницу результатов поиска"""
+        url = f"{self.url}/rest/api/2/search"
+        params = {
+            'jql': jql,
+            'startAt': start_at,
+            'maxResults': page_size,
+            'fields': fields or self.ISSUE_FIELDS
+        }
+        if validate_query:
+            params['validateQuery'] = validate_query
+        
+        try:
+            response = self.session.get(url, params=params)
+        except Exception as e:
+            raise JiraSearchError(f"Error fetching Jira issues: {e}")
+        
+        if response.status_code != 200:
+            raise JiraSearchError(f"Jira API error: {response.status_code}")
+        
+        return response.json()
+    
+    def iter_issue_pages(self, jql=None, page_size=None, prefetch=None, fields=None, validate_query=None):
+        """Постранично получать задачи из Jira (генератор страниц).
+        
+        fields - список полей через запятую (по умолчанию ISSUE_FIELDS);
+        validate_query='warn' - несуществующие ключи в "key in (...)" не считаются ошибкой.
+        """
+        if not jql:
+            jql = f"project = {self.project_key}"
+        jql = self.scoped_jql(jql)
+        page_size = page_size or self.page_size
+        prefetch = self.prefetch if prefetch is None else prefetch
+        
+        # Следующая страница может загружаться, пока обрабатывается текущая
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            data = self._search_page(jql, 0, page_size, fields, validate_query)
+            while True:
                 issues = data.get('issues', [])
-                return True, issues
-            else:
-                return False, f"Jira API error: {response.status_code}"
+                total = data.get('total', 0)
+                # Jira может урезать maxResults, поэтому сдвигаемся на фактический размер страницы
+                next_start = data.get('startAt', 0) + len(issues)
+                has_more = bool(issues) and next_start < total
+                
+                next_page = None
+                if has_more and executor:
+                    next_page = executor.submit(self._search_page, jql, next_start, page_size, fields, validate_query)
+                
+                yield issues
                 
+                if not has_more:
+                    break
+                data = next_page.result() if next_page else self._search_page(jql, next_start, page_size, fields, validate_query)
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+    
+    def scoped_jql(self, jql):
+        """Добавить к JQL условие на проект клиента, если включено scope_project"""
+        if not self.scope_project or not self.project_key:
+            return jql
+        parts = re.split(r'\s+(ORDER\s+BY\s+.*)$', jql, maxsplit=1, flags=re.IGNORECASE)
+        scoped = f'project = "{self.project_key}" AND ({parts[0]})'
+        return f"{scoped} {parts[1]}" if len(parts) > 1 else scoped
+    
+    def iter_issues(self, jql=None, page_size=None, prefetch=None, fields=None, validate_query=None):
+        """Потоково получать задачи из Jira по одной"""
+        for page in self.iter_issue_pages(jql, page_size, prefetch, fields, validate_query):
+            for issue in page:
+                yield issue
+    
+    @instrumented('jira')
+    def get_issues(self, jql=None, max_results=None, page_size=None, fields=None):
+        """Получить задачи из Jira (все страницы или первые max_results)"""
+        try:
+            issues = []
+            for issue in self.iter_issues(jql, page_size, fields=fields):
+                issues.append(issue)
+                if max_results and len(issues) >= max_results:
+                    break
+            return True, issues
+        except JiraSearchError as e:
+            return False, str(e)
         except Exception as e:
             return False, f"Error fetching Jira issues: {e}"
     
+    @instrumented('jira')
+    def get_comments(self, issue_key, start_at=0):
+        """Получить комментарии задачи начиная с start_at (все страницы)"""
+        url = f"{self.url}/rest/api/2/issue/{issue_key}/comment"
+        comments = []
+        while True:
+            params = {'startAt': start_at, 'maxResults': self.page_size}
+            response = self.session.get(url, params=params)
+            if response.status_code != 200:
+                raise JiraSearchError(f"Error getting comments: {response.status_code}")
+            data = response.json()
+            page = data.get('comments', [])
+            comments.extend(page)
+            start_at = data.get('startAt', start_at) + len(page)
+            if not page or start_at >= data.get('total', 0):
+                return comments
+    
+    @instrumented('jira')
     def get_projects(self):
         """Получить список проектов"""
         try:
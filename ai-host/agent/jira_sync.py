@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+from datetime import timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dateutil import parser as date_parser
+
+# Наибольшая разница между часовыми поясами (UTC-12 ... UTC+14)
+MAX_TZ_OFFSET = timedelta(hours=26)
+
+class IncrementalSync:
+    """Инкрементальная выборка задач Jira по водяному знаку поля updated"""
+    
+    def __init__(self, jira_client, state_path, full_sync_interval=3600, overlap_minutes=1):
+        self.jira = jira_client
+        self.state_path = state_path
+        self.full_sync_interval = full_sync_interval
+        self.overlap = timedelta(minutes=overlap_minutes)
+        self._lock = threading.Lock()
+        self._pending = {}
+        # Сброс (reset) делает недействительными выборки, начатые до него
+        self._generation = 0
+        # Часовой пояс, в котором Jira читает даты JQL: пояс профиля пользователя агента
+        self._timezone = None
+        self._timezone_loaded = False
+        self.state = self._load_state()
+    
+    def _load_state(self):
+        """Загрузить сохраненные водяные знаки"""
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️  Error loading sync state, starting from full sync: {e}")
+            return {}
+    
+    def _save_state(self):
+        """Атомарно сохранить водяные знаки на диск"""
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Уникальное имя временного файла: в каталог состояния могут писать несколько процессов
+        fd, tmp_path = tempfile.mkstemp(dir=directory or None, prefix=f"{os.path.basename(self.state_path)}.",
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.state_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    @staticmethod
+    def _parse_updated(issue):
+        """Достать поле updated задачи как datetime"""
+        updated = issue.get('fields', {}).get('updated')
+        if not updated:
+            return None
+        try:
+            return date_parser.isoparse(updated)
+        except (ValueError, TypeError):
+            return None
+    
+    @staticmethod
+    def with_updated_clause(jql, since):
+        """Добавить к JQL условие updated >= since (с сохранением ORDER BY).
+        
+        since должен быть уже в часовом поясе пользователя Jira: JQL понимает
+        даты с точностью до минуты как "настенное" время этого пояса.
+        """
+        parts = re.split(r'\s+ORDER\s+BY\s+', jql, maxsplit=1, flags=re.IGNORECASE)
+        clause = f'updated >= "{since.strftime("%Y/%m/%d %H:%M")}"'
+        query = f"({parts[0]}) AND {clause}"
+        if len(parts) > 1:
+            query += f" ORDER BY {parts[1]}"
+        return query
+    
+    def _user_timezone(self):
+        """Пояс профиля пользователя Jira (запрашивается один раз), None - неизвестен"""
+        if not self._timezone_loaded:
+            name = self.jira.get_user_timezone()
+            try:
+                self._timezone = ZoneInfo(name) if name else None
+            except (ZoneInfoNotFoundError, ValueError):
+                print(f"⚠️  Unknown Jira time zone '{name}'")
+                self._timezone = None
+            self._timezone_loaded = True
+        return self._timezone
+    
+    def _margin(self):
+        """Перекрытие окна выборки.
+        
+        Водяной знак хранит смещение сервера Jira (из поля updated), а JQL
+        читает дату в поясе профиля пользователя. Если пояс узнать не удалось,
+        перекрытие расширяем на максимально возможную разницу поясов.
+        """
+        if self._user_timezone() is None:
+            return max(self.overlap, MAX_TZ_OFFSET)
+        return self.overlap
+    
+    def _since(self, watermark):
+        """Начало окна выборки в часовом поясе пользователя Jira"""
+        since = watermark - self._margin()
+        timezone = self._user_timezone()
+        return since.astimezone(timezone) if timezone else since
+    
+    def _needs_full_sync(self, entry):
+        """Пора ли делать полную сверку"""
+        if not entry.get('watermark'):
+            return True
+        return time.time() - entry.get('last_full_sync', 0) >= self.full_sync_interval
+    
+    def iter_issues(self, name, jql, fields=None):
+        """Потоково получить задачи, изменившиеся с прошлого опроса запроса name"""
+        with self._lock:
+            entry = dict(self.state.get(name, {}))
+            generation = self._generation
+        
+        full_sync = self._needs_full_sync(entry)
+        watermark = None if full_sync else date_parser.isoparse(entry['watermark'])
+        query = jql if full_sync else self.with_updated_clause(jql, self._since(watermark))
+        # Задачи из окна перекрытия, которые уже отдавали с тем же updated
+        delivered = {} if full_sync else entry.get('recent', {})
+        
+        newest = watermark
+        recent = {}
+        for issue in self.jira.iter_issues(jql=query, fields=fields):
+            updated_raw = issue.get('fields', {}).get('updated')
+            updated = self._parse_updated(issue)
+            if updated and (newest is None or updated > newest):
+                newest = updated
+            if updated:
+                recent[issue['key']] = updated_raw
+            if delivered.get(issue['key']) == updated_raw:
+                continue
+            yield issue
+        
+        # Водяной знак фиксируется только через commit(), после успешной обработки
+        if newest is not None:
+            window_start = newest - self._margin()
+            recent = {
+                key: value for key, value in recent.items()
+                if date_parser.isoparse(value) >= window_start
+            }
+        pending = {
+            'watermark': newest.isoformat() if newest else entry.get('watermark'),
+            'recent': recent,
+            'last_full_sync': time.time() if full_sync else entry.get('last_full_sync', 0),
+            'generation': generation
+        }
+        with self._lock:
+            self._pending[name] = pending
+        
+        mode = "full" if full_sync else f"since {watermark.isoformat()}"
+        print(f"   🔁 Sync '{name}': {mode}")
+    
+    def commit(self, name):
+        """Сохранить водяной знак запроса name после обработки выборки"""
+        with self._lock:
+            pending = self._pending.pop(name, None)
+            if pending is None or pending.pop('generation') != self._generation:
+                return
+            self.state[name] = pending
+            try:
+                self._save_state()
+            except Exception as e:
+                print(f"⚠️  Error saving sync state: {e}")
+    
+    def reset(self, name=None):
+        """Сбросить водяной знак (следующий опрос будет полным).
+        
+        Выборки, начатые до сброса, водяной знак уже не сдвигают.
+        """
+        with self._lock:
+            self._generation += 1
+            if name is None:
+                self.state.clear()
+                self._pending.clear()
+            else:
+                self.state.pop(name, None)
+                self._pending.pop(name, None)
+            self._save_state()
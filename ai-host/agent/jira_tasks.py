@@ -1,8 +1,13 @@
-from jira_client import JiraClient
+from jira_client import JiraClient, jql_key_list
+from metrics import instrumented
+import threading
 
 class JiraTasks:
     def __init__(self, jira_client):
         self.jira = jira_client
+        # Переходы workflow: (project, issuetype id, status id) -> {имя: (id, имя)}
+        self._transitions_cache = {}
+        self._transitions_lock = threading.Lock()
     
     def get_my_todo_tasks(self, username):
         """Получить задачи назначенные на меня со статусом To Do"""
@@ -24,6 +29,26 @@ class JiraTasks:
         else:
             return False, result
     
+    def iter_my_in_progress_tasks(self, username, sync=None):
+        """Потоково получать задачи со статусом In Progress (постранично)"""
+        jql = f"assignee = '{username}' AND status = 'In Progress'"
+        if sync:
+            # Только задачи, изменившиеся с прошлого опроса
+            return sync.iter_issues(self.in_progress_sync_name(username), jql)
+        return self.jira.iter_issues(jql=jql)
+    
+    def iter_my_in_progress_tasks_by_keys(self, username, keys):
+        """Потоково получить задачи In Progress из списка ключей (для событий вебхуков)"""
+        jql = f"assignee = '{username}' AND status = 'In Progress' AND key in ({jql_key_list(keys)})"
+        # Задачу могли удалить после события - такой ключ не должен ломать весь запрос
+        return self.jira.iter_issues(jql=jql, validate_query='warn')
+    
+    @staticmethod
+    def in_progress_sync_name(username):
+        """Имя запроса In Progress для инкрементальной синхронизации"""
+        return f"in_progress:{username}"
+    
+    @instrumented('jira')
     def get_task_details(self, issue_key):
         """Получить детальную информацию о задаче"""
         try:
@@ -37,46 +62,105 @@ class JiraTasks:
         except Exception as e:
             return False, f"Error fetching task details: {e}"
     
-    def transition_task(self, issue_key, transition_name):
-        """Изменить статус задачи"""
+    @staticmethod
+    def _workflow_key(issue):
+        """Ключ кэша переходов: проект, тип задачи и текущий статус (None, если полей нет)"""
+        if not issue:
+            return None
+        fields = issue.get('fields') or {}
+        project = (fields.get('project') or {}).get('key') or issue['key'].rsplit('-', 1)[0]
+        issue_type = (fields.get('issuetype') or {}).get('id')
+        status = (fields.get('status') or {}).get('id')
+        if not issue_type or not status:
+            return None
+        return (project, issue_type, status)
+    
+    def _fetch_transitions(self, issue_key, workflow_key=None):
+        """Получить доступные переходы {имя в нижнем регистре: (id, имя)} и запомнить их"""
+        transitions_url = f"{self.jira.url}/rest/api/2/issue/{issue_key}/transitions"
+        response = self.jira.session.get(transitions_url)
+        
+        if response.status_code != 200:
+            raise RuntimeError(f"Error getting transitions: {response.status_code}")
+        
+        transitions = {
+            t['name'].lower(): (t['id'], t['name'])
+            for t in response.json().get('transitions', [])
+        }
+        if workflow_key:
+            with self._transitions_lock:
+                self._transitions_cache[workflow_key] = transitions
+        return transitions
+    
+    def _cached_transitions(self, workflow_key):
+        if not workflow_key:
+            return None
+        with self._transitions_lock:
+            return self._transitions_cache.get(workflow_key)
+    
+    def invalidate_transitions(self, workflow_key=None):
+        """Сбросить кэш переходов (весь или для одного проекта/типа/статуса)"""
+        with self._transitions_lock:
+            if workflow_key is None:
+                self._transitions_cache.clear()
+            else:
+                self._transitions_cache.pop(workflow_key, None)
+    
+    @instrumented('jira')
+    def transition_task(self, issue_key, transition_name, issue=None):
+        """Изменить статус задачи.
+        
+        transition_name - имя перехода или список имен-кандидатов (берется первый доступный).
+        Если передана сама задача issue (с полями project, issuetype, status), id переходов
+        берутся из кэша по ее проекту, типу и статусу без запроса списка переходов.
+        """
+        names = [transition_name] if isinstance(transition_name, str) else list(transition_name)
+        workflow_key = self._workflow_key(issue)
+        
         try:
-            # Сначала получаем доступные переходы
             transitions_url = f"{self.jira.url}/rest/api/2/issue/{issue_key}/transitions"
-            response = self.jira.session.get(transitions_url)
+            transitions = self._cached_transitions(workflow_key)
+            from_cache = transitions is not None
             
-            if response.status_code != 200:
-                return False, f"Error getting transitions: {response.status_code}"
-            
-            transitions = response.json().get('transitions', [])
-            target_transition = None
-            
-            # Ищем нужный переход
-            for transition in transitions:
-                if transition['name'].lower() == transition_name.lower():
-                    target_transition = transition
-                    break
-            
-            if not target_transition:
-                available_transitions = [t['name'] for t in transitions]
-                return False, f"Transition '{transition_name}' not found. Available: {available_transitions}"
-            
-            # Выполняем переход
-            transition_data = {
-                'transition': {
-                    'id': target_transition['id']
+            while True:
+                if transitions is None:
+                    # Получаем доступные переходы
+                    transitions = self._fetch_transitions(issue_key, workflow_key)
+                
+                # Ищем первый доступный переход из кандидатов
+                target = next((transitions[n.lower()] for n in names if n.lower() in transitions), None)
+                
+                if not target:
+                    if from_cache:
+                        # Схема могла измениться - перечитываем переходы
+                        self.invalidate_transitions(workflow_key)
+                        transitions, from_cache = None, False
+                        continue
+                    available_transitions = [name for _, name in transitions.values()]
+                    return False, f"Transition {' / '.join(repr(n) for n in names)} not found. Available: {available_transitions}"
+                
+                # Выполняем переход
+                transition_data = {
+                    'transition': {
+                        'id': target[0]
+                    }
                 }
-            }
-            
-            response = self.jira.session.post(transitions_url, json=transition_data)
-            
-            if response.status_code == 204:
-                return True, f"Task {issue_key} moved to {transition_name}"
-            else:
+                
+                response = self.jira.session.post(transitions_url, json=transition_data)
+                
+                if response.status_code == 204:
+                    return True, f"Task {issue_key} moved to {target[1]}"
+                if response.status_code in (400, 404) and from_cache:
+                    # Id из кэша не подошел (статус задачи или схема изменились) - пробуем еще раз
+                    self.invalidate_transitions(workflow_key)
+                    transitions, from_cache = None, False
+                    continue
                 return False, f"Error transitioning task: {response.text}"
                 
         except Exception as e:
             return False, f"Error transitioning task: {e}"
     
+    @instrumented('jira')
     def add_comment(self, issue_key, comment):
         """Добавить комментарий к задаче"""
         try:
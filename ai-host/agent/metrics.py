@@ -0,0 +1,230 @@
+import time
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Базовая метрика с набором меток"""
+    
+    TYPE = None
+    
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+    
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+    
+    def values(self):
+        """Копия текущих значений: {кортеж значений меток: значение}"""
+        with self._lock:
+            return {
+                key: dict(value, counts=list(value['counts'])) if isinstance(value, dict) else value
+                for key, value in self._values.items()
+            }
+
+class Counter(_Metric):
+    TYPE = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    TYPE = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+    
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+    
+    def __init__(self, name, documentation, labels=(), buckets=None):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets or self.DEFAULT_BUCKETS)) + (float('inf'),)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+    
+    def _render_sample(self, key, value):
+        lines = []
+        for bound, count in zip(self.buckets, value['counts']):
+            labels = _format_labels(self.label_names, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(value['sum'])}")
+        lines.append(f"{self.name}_count{labels} {value['count']}")
+        return lines
+
+class MetricsRegistry:
+    """Набор метрик, отдаваемых в текстовом формате Prometheus"""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+    
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+    
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+    
+    def histogram(self, name, documentation, labels=(), buckets=None):
+        return self._register(Histogram(name, documentation, labels, buckets))
+    
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+CLIENT_REQUESTS = REGISTRY.counter(
+    'agent_client_requests_total', 'Calls of client methods', ('client', 'method'))
+CLIENT_ERRORS = REGISTRY.counter(
+    'agent_client_errors_total', 'Failed calls of client methods', ('client', 'method'))
+CLIENT_LATENCY = REGISTRY.histogram(
+    'agent_client_request_duration_seconds', 'Duration of client method calls', ('client', 'method'))
+CYCLE_DURATION = REGISTRY.histogram(
+    'agent_cycle_duration_seconds', 'Duration of agent cycles', ('agent',),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800))
+CYCLE_FAILURES = REGISTRY.counter(
+    'agent_cycle_failures_total', 'Agent cycles that raised an exception', ('agent',))
+CYCLE_TASKS = REGISTRY.gauge(
+    'agent_cycle_tasks', 'Tasks processed in the last agent cycle', ('agent',))
+TASKS_PROCESSED = REGISTRY.counter(
+    'agent_tasks_processed_total', 'Tasks processed by agents', ('agent',))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'agent_queue_depth', 'Tasks fetched and waiting to be processed', ('agent',))
+
+def _is_failure(result):
+    """Клиенты сообщают об ошибке кортежем (False, message) или просто False"""
+    if result is False:
+        return True
+    return isinstance(result, tuple) and len(result) > 0 and result[0] is False
+
+def instrumented(client, method=None, is_failure=None):
+    """Декоратор метода клиента: число вызовов, ошибок и гистограмма длительности.
+    
+    method - имя в метках (по умолчанию имя функции), is_failure(result) - свое
+    правило ошибки, если не всякий ответ (False, ...) - сбой.
+    """
+    check = is_failure or _is_failure
+    
+    def decorator(func):
+        name = method or func.__name__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = check(result)
+                return result
+            finally:
+                CLIENT_LATENCY.observe(time.perf_counter() - started, client=client, method=name)
+                CLIENT_REQUESTS.inc(client=client, method=name)
+                if failed:
+                    CLIENT_ERRORS.inc(client=client, method=name)
+        return wrapper
+    return decorator
+
+def record_cycle(agent, tasks):
+    """Итог цикла агента: сколько задач обработано"""
+    CYCLE_TASKS.set(tasks, agent=agent)
+    record_tasks(agent, tasks)
+
+def record_tasks(agent, tasks):
+    """Задачи, обработанные вне цикла (разгрузка очереди): только общий счетчик"""
+    TASKS_PROCESSED.inc(tasks, agent=agent)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+    
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host='0.0.0.0', port=9100, registry=REGISTRY):
+    """Запустить HTTP-эндпоинт /metrics в фоновом потоке"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    print(f"📈 Metrics endpoint: http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,91 @@
+import math
+
+def estimate_tokens(text):
+    """Локальная оценка числа токенов без токенизатора модели.
+    
+    Латиница, цифры и пунктуация - около 4 символов на токен, кириллица и
+    прочие символы - около 2. Оценка намеренно с запасом.
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
+
+def truncate_to_tokens(text, max_tokens):
+    """Обрезать текст до max_tokens (по оценке), отметив обрезку многоточием"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) < max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + '…'
+
+class PromptBuilder:
+    """Бюджет токенов для промптов ревью.
+    
+    budget - токены на комментарии (или описания работы) в одном промпте,
+    description_budget - на описание задачи. Промпт ограничен сверху, поэтому
+    num_ctx можно задать один на все запросы: смена num_ctx заставляет Ollama
+    перезагружать модель.
+    """
+    
+    # Шаблон промпта, название задачи и прочий текст вне бюджетов
+    TEMPLATE_TOKENS = 512
+    CONTEXT_STEP = 1024
+    
+    def __init__(self, budget=2048, description_budget=1024, max_tokens=500, num_ctx=None,
+                 max_item_share=0.25, combined_max_tokens=1200):
+        self.budget = budget
+        self.description_budget = description_budget
+        self.max_tokens = max_tokens
+        # JSON-ответ комбинированного ревью из шести полей на русском заметно длиннее
+        self.combined_max_tokens = max(max_tokens, combined_max_tokens)
+        # Один длинный комментарий не должен вытеснить все остальные
+        self.max_item_tokens = max(64, int(budget * max_item_share))
+        self.num_ctx = num_ctx or self._fit_context()
+    
+    def _fit_context(self):
+        needed = self.TEMPLATE_TOKENS + self.description_budget + self.budget + self.combined_max_tokens
+        return math.ceil(needed / self.CONTEXT_STEP) * self.CONTEXT_STEP
+    
+    def description(self, text):
+        """Описание задачи в пределах своего бюджета"""
+        return truncate_to_tokens(text or '', self.description_budget)
+    
+    def select_recent(self, items, render, budget=None):
+        """Выбрать самые свежие элементы, помещающиеся в бюджет.
+        
+        items - в хронологическом порядке, render(item) -> строка промпта.
+        Возвращает (строки выбранных элементов в хронологическом порядке,
+        не поместившиеся более старые элементы).
+        """
+        budget = self.budget if budget is None else budget
+        lines = []
+        used = 0
+        for position in range(len(items) - 1, -1, -1):
+            line = truncate_to_tokens(render(items[position]), self.max_item_tokens)
+            cost = estimate_tokens(line) + 1
+            if used + cost > budget:
+                return lines[::-1], items[:position + 1]
+            lines.append(line)
+            used += cost
+        return lines[::-1], []
+    
+    def chunks(self, items, render, budget=None):
+        """Разбить элементы на последовательные части, каждая в пределах бюджета"""
+        budget = self.budget if budget is None else budget
+        chunk, used = [], 0
+        for item in items:
+            line = truncate_to_tokens(render(item), self.max_item_tokens)
+            cost = estimate_tokens(line) + 1
+            if chunk and used + cost > budget:
+                yield chunk
+                chunk, used = [], 0
+            chunk.append(line)
+            used += cost
+        if chunk:
+            yield chunk
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+class ResponseCache:
+    """Двухуровневый кэш ответов AI: LRU в памяти + SQLite на диске"""
+    
+    def __init__(self, max_entries=256, ttl=86400, disk_path=None, disk_max_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expired': 0
+        }
+        
+        self._conn = None
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS ai_response_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+    
+    @staticmethod
+    def make_key(endpoint, payload):
+        """Ключ кэша: хэш эндпоинта, модели, промпта/сообщений и опций"""
+        material = {k: v for k, v in payload.items() if k != 'stream'}
+        material['endpoint'] = endpoint
+        raw = json.dumps(material, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _is_expired(self, created_at, now):
+        return bool(self.ttl) and now - created_at >= self.ttl
+    
+    def get(self, key):
+        """Получить ответ из кэша или None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._is_expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+                self._stats['expired'] += 1
+            
+            if self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT value, created_at FROM ai_response_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    if not self._is_expired(row[1], now):
+                        self._conn.execute(
+                            'UPDATE ai_response_cache SET accessed_at = ? WHERE key = ?', (now, key)
+                        )
+                        # Поднимаем запись в память
+                        self._remember(key, row[0], row[1])
+                        self._stats['disk_hits'] += 1
+                        return row[0]
+                    self._conn.execute('DELETE FROM ai_response_cache WHERE key = ?', (key,))
+                    self._stats['expired'] += 1
+            
+            self._stats['misses'] += 1
+            return None
+    
+    def set(self, key, value):
+        """Сохранить ответ в оба уровня кэша"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._conn is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO ai_response_cache (key, value, created_at, accessed_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    (key, value, now, now)
+                )
+                self._trim_disk()
+    
+    def delete(self, key):
+        """Удалить ответ из обоих уровней кэша"""
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM ai_response_cache WHERE key = ?', (key,))
+    
+    def _remember(self, key, value, created_at):
+        """Положить запись в LRU (под блокировкой)"""
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+    
+    def _trim_disk(self):
+        """Вытеснить самые давно использованные записи с диска (под блокировкой)"""
+        if not self.disk_max_entries:
+            return
+        count = self._conn.execute('SELECT COUNT(*) FROM ai_response_cache').fetchone()[0]
+        overflow = count - self.disk_max_entries
+        if overflow > 0:
+            self._conn.execute(
+                'DELETE FROM ai_response_cache WHERE key IN ('
+                'SELECT key FROM ai_response_cache ORDER BY accessed_at ASC LIMIT ?)',
+                (overflow,)
+            )
+            self._stats['evictions'] += overflow
+    
+    def clear(self):
+        """Очистить оба уровня кэша"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM ai_response_cache')
+    
+    def stats(self):
+        """Статистика попаданий и промахов"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        return stats
@@ -1,21 +1,159 @@
+import json
 import time
 import schedule
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-from jira_client import JiraClient
+from jira_client import JiraClient, JiraSearchError, is_issue_key, jql_key_list
 from ai_client import AIClient
+from state_store import MemoryStateStore, fingerprint
+from metrics import record_cycle
+from sharding import ShardCoordinator
+from prompt_builder import PromptBuilder, truncate_to_tokens
+from work_queue import WorkQueue, issue_priority, PRIORITY_EVENT, PRIORITY_POLL
+
+COMPLETION_STATUSES = ('выполнена', 'частично выполнена', 'не выполнена')
+
+# JSON-схема ответа для Ollama (поле format)
+REVIEW_RESULT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'understanding': {'type': 'string'},
+        'work_found': {'type': 'boolean'},
+        'completion_status': {'type': 'string', 'enum': list(COMPLETION_STATUSES)},
+        'completion_assessment': {'type': 'string'},
+        'recommendations': {'type': 'string'},
+        'verdict': {'type': 'string'}
+    },
+    'required': [
+        'understanding', 'work_found', 'completion_status',
+        'completion_assessment', 'recommendations', 'verdict'
+    ]
+}
+
+@dataclass
+class ReviewResult:
+    """Структурированный результат ревью, полученный одним запросом к AI"""
+    understanding: str
+    work_found: bool
+    completion_status: str
+    completion_assessment: str
+    recommendations: str
+    verdict: str
+    
+    @classmethod
+    def from_json(cls, raw):
+        """Разобрать и проверить JSON-ответ модели"""
+        try:
+            data = json.loads(raw)
+        except (TypeError, json.JSONDecodeError) as e:
+            raise ValueError(f"not a JSON object: {e}")
+        if not isinstance(data, dict):
+            raise ValueError("not a JSON object")
+        
+        missing = [name for name in REVIEW_RESULT_SCHEMA['required'] if name not in data]
+        if missing:
+            raise ValueError(f"missing fields: {', '.join(missing)}")
+        
+        status = str(data['completion_status']).strip().lower()
+        if status not in COMPLETION_STATUSES:
+            raise ValueError(f"unknown completion_status: {data['completion_status']}")
+        
+        work_found = data['work_found']
+        if isinstance(work_found, str):
+            work_found = work_found.strip().lower() in ('true', 'да', 'yes')
+        
+        return cls(
+            understanding=str(data['understanding']).strip(),
+            work_found=bool(work_found),
+            completion_status=status,
+            completion_assessment=str(data['completion_assessment']).strip(),
+            recommendations=str(data['recommendations'] or '').strip(),
+            verdict=str(data['verdict']).strip()
+        )
+    
+    @classmethod
+    def is_valid(cls, raw):
+        """Разбирается ли ответ модели (неполный JSON не кэшируем)"""
+        try:
+            cls.from_json(raw)
+        except ValueError:
+            return False
+        return True
+    
+    def as_lines(self):
+        """Строки лога в том же виде, что и у пошагового ревью"""
+        opinion = f"Оценка: {self.completion_status}\n{self.verdict}"
+        if self.recommendations:
+            opinion += f"\nРекомендации: {self.recommendations}"
+        return [
+            f"🤖 AI понимание задания:\n{self.understanding}",
+            f"🤖 AI анализ выполненной работы:\n{self.completion_assessment}",
+            f"🤖 AI вердикт по задаче:\n{opinion}"
+        ]
 
 class ReviewAgent:
-    def __init__(self, jira_client, ai_client, username):
+    SYNC_NAME = 'in_review'
+    METRICS_NAME = 'review_agent'
+    # Комментарии приходят прямо в ответе поиска - без отдельного запроса на задачу
+    REVIEW_FIELDS = JiraClient.ISSUE_FIELDS + ',comment'
+    STATE_NAMESPACE = 'reviews'
+    # Накопительное резюме старых комментариев, не влезающих в бюджет промпта
+    SUMMARY_NAMESPACE = 'comment_summaries'
+    
+    def __init__(self, jira_client, ai_client, username, sync=None,
+                 state_store=None, review_ttl=None,
+                 max_workers=1, jira_concurrency=4, ai_concurrency=1,
+                 combined_review=False, queue_capacity=1000, queue_batch=50,
+                 retry_attempts=3, retry_delay=60, shard=None, name=None,
+                 max_tasks_per_cycle=0, review_interval=60, ai_slots=None,
+                 prompt_builder=None, summarize_comments=True, ai_sessions=False, summary_ttl=604800):
         self.jira = jira_client
         self.ai = ai_client
         self.username = username
-        self.timeDelay = 60  # 60 секунд между проверками
+        self.sync = sync
+        # Последний результат ревью по каждой задаче вместе с отпечатком
+        self.state = state_store or MemoryStateStore()
+        self.review_ttl = review_ttl
+        self.timeDelay = review_interval  # секунд между проверками
+        # Ревью одним JSON-запросом вместо трех (с откатом на пошаговый режим)
+        self.combined_review = combined_review
+        # Бюджет токенов промптов и num_ctx под него
+        self.prompts = prompt_builder or PromptBuilder()
+        self.summarize_comments = summarize_comments
+        # Резюме задач, которые больше не ревьюят, удаляет ежечасная очистка хранилища
+        self.summary_ttl = summary_ttl
+        # Сессия AI на задачу: описание задачи - общий префикс всех ее промптов,
+        # модель вычисляет его один раз (см. AIClient.open_session)
+        self.ai_sessions = ai_sessions
+        self._ai_session = threading.local()
         
+        # Параллельное ревью: отдельные лимиты на запросы к Jira и к Ollama.
+        # ai_concurrency стоит держать равным OLLAMA_NUM_PARALLEL на сервере;
+        # ai_slots - общий на все проекты семафор, если Ollama одна на несколько агентов
+        self.max_workers = max(1, max_workers)
+        self._jira_slots = threading.BoundedSemaphore(max(1, jira_concurrency))
+        self._ai_slots = ai_slots or threading.BoundedSemaphore(max(1, ai_concurrency))
+        # Буфер вывода текущего потока (чтобы лог шел в порядке задач)
+        self._output = threading.local()
+        # Опрос по расписанию и ревью по событиям не должны идти одновременно
+        self._cycle_lock = threading.Lock()
+        # Очередь ревью: одна запись на задачу, сколько бы раз ее ни нашли
+        self.metrics_name = f"{self.METRICS_NAME}:{name}" if name else self.METRICS_NAME
+        self.max_tasks_per_cycle = max_tasks_per_cycle
+        self.queue = WorkQueue(self.metrics_name, capacity=queue_capacity,
+                               max_attempts=retry_attempts, retry_delay=retry_delay)
+        self.queue_batch = queue_batch
+        # При нескольких воркерах каждая задача принадлежит ровно одному из них
+        self.shard = shard or ShardCoordinator()
+    
     def get_in_review_tasks(self):
         """Получить задачи в статусе In Review"""
         try:
             jql = 'status = "In Review"'
-            success, result = self.jira.get_issues(jql=jql)
+            success, result = self.jira.get_issues(jql=jql, fields=self.REVIEW_FIELDS)
             
             if success:
                 return True, result
@@ -24,17 +162,32 @@ class ReviewAgent:
         except Exception as e:
             return False, f"Error getting In Review tasks: {e}"
     
-    def get_task_comments(self, issue_key):
-        """Получить комментарии к задаче"""
+    def iter_in_review_tasks(self):
+        """Потоково получать задачи в статусе In Review (постранично, с комментариями)"""
+        jql = 'status = "In Review"'
+        if self.sync:
+            # Только задачи, изменившиеся с прошлого опроса
+            return self.sync.iter_issues(self.SYNC_NAME, jql, fields=self.REVIEW_FIELDS)
+        return self.jira.iter_issues(jql=jql, fields=self.REVIEW_FIELDS)
+    
+    def get_task_comments(self, issue_key, issue=None):
+        """Получить комментарии к задаче.
+        
+        Если задача получена поиском с полем comment, используются встроенные
+        комментарии, а догружаются только те, что не поместились в страницу.
+        """
         try:
-            url = f"{self.jira.url}/rest/api/2/issue/{issue_key}/comment"
-            response = self.jira.session.get(url)
-            
-            if response.status_code == 200:
-                comments_data = response.json()
-                return True, comments_data.get('comments', [])
-            else:
-                return False, f"Error getting comments: {response.status_code}"
+            embedded = ((issue or {}).get('fields') or {}).get('comment')
+            comments = []
+            if embedded is not None:
+                comments = list(embedded.get('comments', []))
+                if len(comments) >= embedded.get('total', 0):
+                    return True, comments
+            with self._jira_slots:
+                comments.extend(self.jira.get_comments(issue_key, start_at=len(comments)))
+            return True, comments
+        except JiraSearchError as e:
+            return False, str(e)
         except Exception as e:
             return False, f"Error fetching comments: {e}"
     
@@ -51,13 +204,106 @@ class ReviewAgent:
         except Exception as e:
             return False, f"Error fetching task details: {e}"
     
+    def _task_preamble(self, task_summary, task_description):
+        """Общее начало промптов о задаче: одинаковый префикс модель может не вычислять заново"""
+        return f"""
+Контекст задачи из Jira:
+
+Название задачи: {task_summary}
+Описание задачи: {self.prompts.description(task_description)}
+"""
+    
+    def _ai_generate(self, prompt, response_format=None, preamble=None, max_tokens=None, validate=None):
+        """Запрос к AI с ограничением числа одновременных генераций.
+        
+        preamble - префикс о задаче; в сессии задачи он уже передан модели.
+        validate - проверка ответа: непрошедший проверку ответ не кэшируется.
+        """
+        session = getattr(self._ai_session, 'key', None) if preamble else None
+        if preamble and session is None:
+            prompt = preamble + prompt
+        with self._ai_slots:
+            return self.ai.generate_response(
+                prompt, max_tokens=max_tokens or self.prompts.max_tokens,
+                response_format=response_format, num_ctx=self.prompts.num_ctx,
+                session=session, validate=validate
+            )
+    
+    @staticmethod
+    def _render_comment(numbered):
+        index, comment = numbered
+        author = (comment.get('author') or {}).get('displayName', 'Unknown')
+        return f"Комментарий {index + 1} ({author}): {comment.get('body', '')}"
+    
+    def _comments_context(self, comments, issue_key=None):
+        """Комментарии для промпта в пределах бюджета: свежие - целиком, более старые - резюме"""
+        if not comments:
+            return "Комментариев нет"
+        numbered = list(enumerate(comments))
+        # Часть бюджета оставляем под резюме старых комментариев
+        summary_budget = self.prompts.budget // 4 if self.summarize_comments and issue_key else 0
+        lines, older = self.prompts.select_recent(numbered, self._render_comment,
+                                                  self.prompts.budget - summary_budget)
+        if older:
+            summary = self._older_comments_summary(issue_key, older, summary_budget) if summary_budget else None
+            if summary:
+                lines.insert(0, f"Краткое содержание {len(older)} более ранних комментариев: {summary}")
+            else:
+                lines.insert(0, f"({len(older)} более ранних комментариев опущено)")
+        return "\n".join(lines)
+    
+    def _older_comments_summary(self, issue_key, older, max_tokens):
+        """Резюме комментариев, вытесненных из промпта.
+        
+        Резюме хранится в state store и дополняется только новыми вытесненными
+        комментариями; если история изменилась (комментарий удален), строится заново.
+        """
+        ids = [str(comment.get('id', '')) for _, comment in older]
+        stored = self.state.get(self.SUMMARY_NAMESPACE, issue_key)
+        data = (stored or {}).get('data') or {}
+        summary, folded = data.get('summary', ''), data.get('count', 0)
+        if not (0 < folded <= len(ids) and ids[folded - 1] == data.get('last_id')):
+            summary, folded = '', 0
+        if folded == len(ids):
+            return summary
+        
+        for chunk in self.prompts.chunks(older[folded:], self._render_comment):
+            new_comments = "\n".join(chunk)
+            prompt = f"""
+Обнови краткое содержание обсуждения задачи Jira с учетом новых комментариев.
+
+Текущее краткое содержание: {summary or "нет"}
+
+Новые комментарии:
+{new_comments}
+
+Ответь на русском, не длиннее {max(1, max_tokens // 3)} слов: что сделано, что обсуждалось, что осталось.
+"""
+            success, response = self._ai_generate(prompt)
+            if not success:
+                self._log(f"   ⚠️  Не удалось обновить резюме старых комментариев: {response}")
+                return summary or None
+            summary = truncate_to_tokens(response.strip(), max_tokens)
+            folded += len(chunk)
+            self.state.put(
+                self.SUMMARY_NAMESPACE, issue_key, fingerprint(ids[:folded]),
+                data={'summary': summary, 'count': folded, 'last_id': ids[folded - 1]},
+                ttl=self.summary_ttl
+            )
+        return summary
+    
+    def _log(self, message):
+        """Вывод строки лога (в буфер потока при параллельном ревью)"""
+        lines = getattr(self._output, 'lines', None)
+        if lines is None:
+            print(message)
+        else:
+            lines.append(message)
+    
     def ai_analyze_task_understanding(self, task_summary, task_description):
         """AI анализ понимания задания"""
         prompt = f"""
-Проанализируй задачу из Jira и объясни, что нужно сделать:
-
-Название задачи: {task_summary}
-Описание задачи: {task_description}
+Проанализируй задачу и объясни, что нужно сделать.
 
 Ответь кратко на русском (2-3 предложения):
 1. В чем суть задачи?
@@ -65,24 +311,18 @@ class ReviewAgent:
 3. Какой ожидается результат?
 """
         
-        success, response = self.ai.generate_response(prompt)
+        success, response = self._ai_generate(prompt, preamble=self._task_preamble(task_summary, task_description))
         if success:
             return f"🤖 AI понимание задания:\n{response}"
         else:
             return f"❌ AI не смог проанализировать задание: {response}"
     
-    def ai_analyze_work_completion(self, task_summary, task_description, comments):
-        """AI анализ выполненной работы на основе комментариев"""
-        comments_text = "\n".join([
-            f"Комментарий {i+1} ({c.get('author', {}).get('displayName', 'Unknown')}): {c.get('body', '')}"
-            for i, c in enumerate(comments)
-        ])
+    def ai_analyze_work_completion(self, task_summary, task_description, comments, issue_key=None):
+        """AI анализ выполненной работы на основе комментариев (в пределах бюджета токенов)"""
+        comments_text = self._comments_context(comments, issue_key)
         
         prompt = f"""
-Проанализируй, выполнена ли задача на основе комментариев:
-
-Задача: {task_summary}
-Описание: {task_description}
+Проанализируй, выполнена ли задача на основе комментариев.
 
 Комментарии к задаче:
 {comments_text}
@@ -93,24 +333,25 @@ class ReviewAgent:
 3. Твоя оценка выполнения (выполнена/частично выполнена/не выполнена)?
 """
         
-        success, response = self.ai.generate_response(prompt)
+        success, response = self._ai_generate(prompt, preamble=self._task_preamble(task_summary, task_description))
         if success:
             return f"🤖 AI анализ выполненной работы:\n{response}"
         else:
             return f"❌ AI не смог проанализировать работу: {response}"
     
     def ai_generate_detailed_opinion(self, task_summary, task_description, work_descriptions):
-        """AI генерация детального мнения о работе"""
-        work_info = "\n".join([
-            f"- {work['author']}: {work['text']}"
-            for work in work_descriptions
-        ]) if work_descriptions else "Описания работы не найдены"
+        """AI генерация детального мнения о работе (самые свежие описания в пределах бюджета)"""
+        work_info = "Описания работы не найдены"
+        if work_descriptions:
+            lines, older = self.prompts.select_recent(
+                work_descriptions, lambda work: f"- {work['author']}: {work['text']}"
+            )
+            if older:
+                lines.insert(0, f"({len(older)} более ранних описаний опущено)")
+            work_info = "\n".join(lines)
         
         prompt = f"""
-Сформулируй профессиональное мнение о выполненной работе:
-
-Задача: {task_summary}
-Исходное описание: {task_description}
+Сформулируй профессиональное мнение о выполненной работе по задаче.
 
 Найденные описания работы:
 {work_info}
@@ -122,12 +363,43 @@ class ReviewAgent:
 - Итоговый вердикт
 """
         
-        success, response = self.ai.generate_response(prompt)
+        success, response = self._ai_generate(prompt, preamble=self._task_preamble(task_summary, task_description))
         if success:
             return f"🤖 AI вердикт по задаче:\n{response}"
         else:
             return f"❌ AI не смог сформировать мнение: {response}"
     
+    def ai_combined_review(self, task_summary, task_description, comments, issue_key=None):
+        """AI ревью за один запрос: понимание, оценка выполнения и вердикт в JSON"""
+        comments_text = self._comments_context(comments, issue_key)
+        
+        prompt = f"""
+Проведи ревью задачи по ее описанию и комментариям.
+
+Комментарии к задаче:
+{comments_text}
+
+Ответь на русском строго в формате JSON с полями:
+- "understanding": суть задачи, что нужно сделать и ожидаемый результат (2-3 предложения)
+- "work_found": есть ли в комментариях указания на выполненную работу (true/false)
+- "completion_status": одно из "выполнена", "частично выполнена", "не выполнена"
+- "completion_assessment": соответствует ли описанная работа исходной задаче (2-3 предложения)
+- "recommendations": рекомендации (пустая строка, если не нужны)
+- "verdict": итоговый вердикт (1-2 предложения)
+"""
+
+        success, response = self._ai_generate(prompt, response_format=REVIEW_RESULT_SCHEMA,
+                                              preamble=self._task_preamble(task_summary, task_description),
+                                              max_tokens=self.prompts.combined_max_tokens,
+                                              validate=ReviewResult.is_valid)
+        if not success:
+            return False, response
+        
+        try:
+            return True, ReviewResult.from_json(response)
+        except ValueError as e:
+            return False, f"invalid JSON review: {e}"
+    
     def analyze_comments_for_work_done(self, comments):
         """Анализ комментариев на предмет выполненной работы"""
         work_descriptions = []
@@ -153,70 +425,285 @@ class ReviewAgent:
         
         return work_descriptions
     
+    def _review_fingerprint(self, task, comments):
+        """Отпечаток задачи для ревью: поля задачи и набор комментариев"""
+        fields = task['fields']
+        comment_marks = sorted(
+            (str(c.get('id', '')), c.get('updated') or c.get('created', ''))
+            for c in comments
+        )
+        return fingerprint(
+            fields.get('summary'),
+            fields.get('description'),
+            (fields.get('status') or {}).get('name'),
+            comment_marks
+        )
+    
     def review_single_task(self, task):
-        """Провести ревью одной задачи по полному алгоритму с AI"""
+        """Провести ревью одной задачи по полному алгоритму с AI; False - ревью не удалось"""
         task_key = task['key']
         task_summary = task['fields']['summary']
         task_description = task['fields'].get('description', 'Описание отсутствует')
         
-        print(f"\n🎯 Ревью задачи: {task_key}")
-        print(f"   📝 Задание: {task_summary}")
-        print(f"   📋 Описание: {task_description[:200]}...")
+        self._log(f"\n🎯 Ревью задачи: {task_key}")
+        self._log(f"   📝 Задание: {task_summary}")
+        self._log(f"   📋 Описание: {task_description[:200]}...")
+        
+        # Комментарии нужны и для отпечатка, поэтому получаем их до обращений к AI
+        comments_success, comments = self.get_task_comments(task_key, issue=task)
+        
+        review_fingerprint = None
+        if comments_success:
+            review_fingerprint = self._review_fingerprint(task, comments)
+            previous = self.state.get(self.STATE_NAMESPACE, task_key)
+            if previous and previous['fingerprint'] == review_fingerprint:
+                # Задача не менялась с прошлого ревью - AI не вызываем
+                self._log(f"   ⏭️  Задача не изменилась с прошлого ревью, пропускаем")
+                for line in (previous['data'] or {}).get('results', []):
+                    self._log(f"   {line}")
+                return True
+        
+        results = None
+        if self.combined_review and comments_success:
+            # Один структурированный запрос вместо трех отдельных генераций
+            results = self._combined_review(task_summary, task_description, comments, task_key)
+        if results is None:
+            results = self._three_step_review(task_summary, task_description, comments_success, comments,
+                                              task_key)
+        
+        # Запоминаем результат только полностью успешного ревью
+        succeeded = comments_success and not any(r.startswith('❌') for r in results)
+        if succeeded:
+            self.state.put(
+                self.STATE_NAMESPACE, task_key, review_fingerprint,
+                data={'results': results}, ttl=self.review_ttl
+            )
+        
+        self._log(f"   ✅ AI-ревью задачи {task_key} завершено")
+        return succeeded
+    
+    def _combined_review(self, task_summary, task_description, comments, issue_key=None):
+        """Ревью одним запросом с JSON-ответом; None - если ответ не удалось разобрать"""
+        success, result = self.ai_combined_review(task_summary, task_description, comments, issue_key)
+        if not success:
+            self._log(f"   ⚠️  Комбинированное ревью не удалось ({result}), переходим к пошаговому")
+            return None
+        
+        self._log(f"   💬 Найдено комментариев: {len(comments)}")
+        self._log(f"   🔍 Найдено описаний работы: {len(self.analyze_comments_for_work_done(comments))}")
+        results = result.as_lines()
+        for line in results:
+            self._log(f"   {line}")
+        return results
+    
+    def _three_step_review(self, task_summary, task_description, comments_success, comments, issue_key=None):
+        """Пошаговое ревью: три отдельных запроса к AI (в сессии задачи, если включены сессии)"""
+        if not (self.ai_sessions and issue_key):
+            return self._run_three_steps(task_summary, task_description, comments_success, comments, issue_key)
+        
+        # Несколько запросов с общим префиксом - его контекст вычисляется один раз
+        self.ai.open_session(issue_key, self._task_preamble(task_summary, task_description))
+        self._ai_session.key = issue_key
+        try:
+            return self._run_three_steps(task_summary, task_description, comments_success, comments, issue_key)
+        finally:
+            self._ai_session.key = None
+            self.ai.close_session(issue_key)
+    
+    def _run_three_steps(self, task_summary, task_description, comments_success, comments, issue_key=None):
+        results = []
         
         # Шаг 3: AI понимание задания
         ai_understanding = self.ai_analyze_task_understanding(task_summary, task_description)
-        print(f"   {ai_understanding}")
+        self._log(f"   {ai_understanding}")
+        results.append(ai_understanding)
         
         # Шаг 4-5: Анализ комментариев
-        comments_success, comments = self.get_task_comments(task_key)
         if comments_success:
-            print(f"   💬 Найдено комментариев: {len(comments)}")
+            self._log(f"   💬 Найдено комментариев: {len(comments)}")
             
             # Базовый анализ комментариев
             work_descriptions = self.analyze_comments_for_work_done(comments)
-            print(f"   🔍 Найдено описаний работы: {len(work_descriptions)}")
+            self._log(f"   🔍 Найдено описаний работы: {len(work_descriptions)}")
             
             # AI анализ выполненной работы
             if comments:
-                ai_work_analysis = self.ai_analyze_work_completion(task_summary, task_description, comments)
-                print(f"   {ai_work_analysis}")
+                ai_work_analysis = self.ai_analyze_work_completion(task_summary, task_description, comments,
+                                                                   issue_key)
+                self._log(f"   {ai_work_analysis}")
+                results.append(ai_work_analysis)
             
             # Шаг 6: Детальное AI мнение о работе
             if work_descriptions:
                 ai_opinion = self.ai_generate_detailed_opinion(task_summary, task_description, work_descriptions)
-                print(f"   {ai_opinion}")
+                self._log(f"   {ai_opinion}")
+                results.append(ai_opinion)
             else:
-                print(f"   📊 Мнение: Не найдено описаний выполненной работы в комментариях")
+                self._log(f"   📊 Мнение: Не найдено описаний выполненной работы в комментариях")
                 
         else:
-            print(f"   ❌ Ошибка получения комментариев: {comments}")
+            self._log(f"   ❌ Ошибка получения комментариев: {comments}")
         
-        print(f"   ✅ AI-ревью задачи {task_key} завершено")
+        return results
+    
+    def _review_logged(self, task, attempts=0):
+        """Ревью одной задачи с обрамляющими строками лога; исход фиксируется в очереди"""
+        self._log(f"\n   🔄 Начинаем AI-ревью задачи {task['key']}")
+        ok = False
+        try:
+            ok = self.review_single_task(task)
+        except Exception as e:
+            self._log(f"   ❌ Ошибка ревью задачи {task['key']}: {e}")
+        if not ok and self.queue.retry(task['key'], task, attempts):
+            self._log(f"   🔁 Повтор ревью {task['key']} (попытка {attempts + 2}) отложен")
+        else:
+            self.queue.done(task['key'])
+        self._log(f"   ⏭️  Переходим к следующей задаче...")
+    
+    def _review_buffered(self, task, attempts=0):
+        """Ревью задачи в рабочем потоке; лог возвращается списком строк"""
+        self._output.lines = []
+        try:
+            self._review_logged(task, attempts)
+            return self._output.lines
+        finally:
+            self._output.lines = None
+    
+    def _review_parallel(self, batch):
+        """Ревью пачки задач пулом потоков; лог печатается в порядке задач"""
+        # Ограничиваем число задач в работе окном, остальные ждут в очереди пула
+        window = self.max_workers * 2
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='review') as executor:
+            try:
+                for _, task, attempts in batch:
+                    pending.append(executor.submit(self._review_buffered, task, attempts))
+                    while len(pending) >= window:
+                        for line in pending.popleft().result():
+                            print(line)
+            finally:
+                while pending:
+                    for line in pending.popleft().result():
+                        print(line)
+        return len(batch)
+    
+    def _review_tasks(self, batch):
+        """Отревьюить пачку из очереди [(key, task, attempts)] (пулом потоков, если он настроен)"""
+        if self.max_workers > 1:
+            return self._review_parallel(batch)
+        for _, task, attempts in batch:
+            self._review_logged(task, attempts)
+        return len(batch)
+    
+    def _enqueue(self, tasks, level, cycle):
+        """Поставить задачи в очередь ревью.
+        
+        Если очередь заполнена, сначала разгружаем ее - так поток задач из
+        постраничного поиска не держится в памяти целиком; отревьюченные при этом
+        задачи добавляются в cycle['processed'].
+        Возвращает (число найденных задач, поставленные ключи, число не поместившихся).
+        """
+        found = 0
+        queued = []
+        rejected = 0
+        for task in tasks:
+            found += 1
+            if not self.shard.owns(task['key']):
+                continue
+            priority = issue_priority(task, level)
+            if not self.queue.put(task['key'], task, priority):
+                cycle['processed'] += self.drain_queue(self.max_tasks_per_cycle)
+                if not self.queue.put(task['key'], task, priority, block=True, timeout=60):
+                    print(f"   ⚠️  ReviewAgent: очередь заполнена, {task['key']} - в следующем цикле")
+                    rejected += 1
+                    continue
+            queued.append(task['key'])
+        return found, queued, rejected
+    
+    def drain_queue(self, limit=None, wait=True):
+        """Отревьюить готовые задачи из очереди пачками (не больше limit), вернуть их число.
+        
+        wait=False - не ждать, если агент уже занят циклом (вернуть 0).
+        """
+        reviewed = 0
+        taken = 0
+        if not self._cycle_lock.acquire(blocking=wait):
+            return 0
+        try:
+            # limit - справедливость между проектами: остаток дождется следующего прохода
+            while not limit or taken < limit:
+                batch = self.queue.get_batch(min(self.queue_batch, limit - taken) if limit else self.queue_batch)
+                if not batch:
+                    break
+                taken += len(batch)
+                claimed = self.shard.claim(key for key, _, _ in batch)
+                try:
+                    reviewed += self._review_tasks([entry for entry in batch if entry[0] in claimed])
+                finally:
+                    for key, _, _ in batch:
+                        self.queue.done(key)
+                    self.shard.release(claimed)
+        finally:
+            self._cycle_lock.release()
+        
+        return reviewed
+    
+    def review_task_keys(self, keys):
+        """Ревью задач по событию (вебхуку): только указанные ключи, если они In Review"""
+        keys = sorted(key for key in set(keys) if is_issue_key(key))
+        if not keys:
+            return 0
+        print(f"\n⚡ ReviewAgent: ревью по событию для {len(keys)} задач: {', '.join(keys[:10])}")
+        
+        jql = f'status = "In Review" AND key in ({jql_key_list(keys)})'
+        cycle = {'processed': 0}
+        try:
+            try:
+                # Задачу могли удалить после события - такой ключ не должен ломать весь запрос
+                self._enqueue(
+                    self.jira.iter_issues(jql=jql, fields=self.REVIEW_FIELDS, validate_query='warn'),
+                    PRIORITY_EVENT, cycle
+                )
+            except JiraSearchError as e:
+                print(f"   ❌ ReviewAgent: Ошибка - {e}")
+            cycle['processed'] += self.drain_queue(self.max_tasks_per_cycle)
+        finally:
+            record_cycle(self.metrics_name, cycle['processed'])
+        return cycle['processed']
     
     def check_review_tasks(self):
         """Проверить задачи для ревью по полному алгоритму с AI"""
         print(f"\n🔍 ReviewAgent: AI-поиск задач In Review в {datetime.now().strftime('%H:%M:%S')}")
         
-        success, result = self.get_in_review_tasks()
+        # Задачи читаются постранично, ревью не меняет выборку;
+        # в памяти - не больше емкости очереди
+        cycle = {'processed': 0}
+        try:
+            try:
+                found, queued, rejected = self._enqueue(self.iter_in_review_tasks(), PRIORITY_POLL, cycle)
+            except JiraSearchError as e:
+                print(f"   ❌ ReviewAgent: Ошибка - {e}")
+                # Уже поставленные задачи все равно отревьюим
+                cycle['processed'] += self.drain_queue(self.max_tasks_per_cycle)
+                return
+            cycle['processed'] += self.drain_queue(self.max_tasks_per_cycle)
+        finally:
+            # Итог пишем раз за цикл, в том числе пустой - иначе метрика хранила бы прошлый цикл
+            record_cycle(self.metrics_name, cycle['processed'])
         
-        if not success:
-            print(f"   ❌ ReviewAgent: Ошибка - {result}")
-            return
+        reviewed = cycle['processed']
+        # Водяной знак двигаем, только когда все найденные задачи отревьючены
+        if rejected or self.queue.has_pending(queued):
+            print("   ⏳ ReviewAgent: часть задач осталась на следующий цикл, водяной знак не сдвигаем")
+        elif self.sync:
+            self.sync.commit(self.SYNC_NAME)
         
-        tasks = result
-        print(f"   📋 ReviewAgent: Найдено {len(tasks)} задач в In Review")
+        print(f"   📋 ReviewAgent: Найдено {found} задач в In Review, отревьючено {reviewed}")
         
-        if not tasks:
+        if not reviewed:
             print("   😴 Нет задач для ревью")
             return
         
-        # Полный AI-алгоритм ревью для каждой задачи
-        for task in tasks:
-            task_key = task['key']
-            print(f"\n   🔄 Начинаем AI-ревью задачи {task_key}")
-            self.review_single_task(task)
-            print(f"   ⏭️  Переходим к следующей задаче...")
-        
         print(f"\n   ✅ Все задачи отревьючены с помощью AI. Ожидание {self.timeDelay} сек...")
     
     def run(self):
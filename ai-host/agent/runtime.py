@@ -0,0 +1,228 @@
+import time
+import signal
+import threading
+import random
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from metrics import CYCLE_DURATION, CYCLE_FAILURES
+
+class PeriodicJob:
+    """Периодическая задача агента"""
+    
+    def __init__(self, name, func, interval, jitter=0.1, run_immediately=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        # Доля интервала, на которую случайно сдвигается запуск (чтобы агенты не шли в ногу)
+        self.jitter = jitter
+        self.run_immediately = run_immediately
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.last_duration = None
+    
+    def next_delay(self, elapsed):
+        """Пауза до следующего запуска с учетом длительности текущего"""
+        spread = self.interval * self.jitter
+        delay = self.interval + random.uniform(-spread, spread) - elapsed
+        if delay < 0:
+            # Запуск длился дольше интервала - пропущенные запуски не догоняем
+            self.overruns += 1
+            return 0
+        return delay
+
+class EventConsumer:
+    """Обработчик событий (вебхуков): получает накопившиеся события пачкой"""
+    
+    def __init__(self, name, handler, batch_window=1.0):
+        self.name = name
+        self.handler = handler
+        # Сколько ждать следующих событий после первого (Jira шлет несколько событий на одно изменение)
+        self.batch_window = batch_window
+        self.running = False
+        self.batches = 0
+        self.failures = 0
+        self._queue = None
+        self._loop = None
+        self._early = []
+        self._lock = threading.Lock()
+    
+    def bind(self, loop):
+        with self._lock:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            for item in self._early:
+                self._queue.put_nowait(item)
+            self._early = []
+    
+    def submit(self, item):
+        """Передать событие (потокобезопасно, можно вызывать из любого потока)"""
+        with self._lock:
+            if self._loop is None:
+                self._early.append(item)
+                return
+            loop, queue = self._loop, self._queue
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+    
+    def drain(self):
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+class AgentRuntime:
+    """Асинхронный рантайм агентов: каждая периодическая задача - отдельная asyncio-задача.
+    
+    asyncio здесь только планирует запуски: клиенты Jira, Gitea и Ollama остаются
+    блокирующими (requests) и выполняются в собственном пуле потоков рантайма,
+    поэтому долгое ревью не задерживает обработку задач и статус репозитория.
+    Задача не запускается повторно, пока не закончился ее предыдущий запуск.
+    
+    Ограничения такого подхода (асинхронных HTTP-клиентов в проекте нет):
+    - каждая выполняющаяся задача или обработчик событий занимает поток пула, поэтому
+      пул не меньше числа задач и обработчиков (max_threads - нижняя граница);
+    - остановка не прерывает уже запущенный в потоке вызов. Через shutdown_timeout
+      run() возвращает управление (и агент освобождает ресурсы), но сам вызов
+      доработает в фоне, и выход процесса ограничен только HTTP-таймаутами клиентов.
+    """
+    
+    def __init__(self, max_threads=8, heartbeat_interval=30, shutdown_timeout=30):
+        self.max_threads = max_threads
+        self.heartbeat_interval = heartbeat_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.jobs = []
+        self.consumers = []
+        self._stop = None
+        self._started_at = None
+        self._executor = None
+    
+    def add_job(self, name, func, interval, jitter=0.1, run_immediately=True):
+        """Зарегистрировать периодическую задачу (func - обычная блокирующая функция)"""
+        job = PeriodicJob(name, func, interval, jitter, run_immediately)
+        self.jobs.append(job)
+        return job
+    
+    def add_consumer(self, name, handler, batch_window=1.0):
+        """Зарегистрировать обработчик событий; handler(items) - обычная блокирующая функция"""
+        consumer = EventConsumer(name, handler, batch_window)
+        self.consumers.append(consumer)
+        return consumer
+    
+    async def _sleep(self, delay):
+        """Пауза, прерываемая остановкой рантайма. Возвращает True, если пора остановиться"""
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=delay)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    def _call(self, func, *args):
+        """Выполнить блокирующую функцию в пуле рантайма"""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(func, *args))
+    
+    async def _run_job(self, job):
+        if not job.run_immediately and await self._sleep(job.next_delay(0)):
+            return
+        
+        while not self._stop.is_set():
+            started = time.monotonic()
+            job.running = True
+            try:
+                await self._call(job.func)
+                job.runs += 1
+            except Exception as e:
+                job.failures += 1
+                CYCLE_FAILURES.inc(agent=job.name)
+                print(f"❌ Job '{job.name}' failed: {e}")
+            finally:
+                job.running = False
+                job.last_duration = time.monotonic() - started
+                CYCLE_DURATION.observe(job.last_duration, agent=job.name)
+            
+            if await self._sleep(job.next_delay(job.last_duration)):
+                return
+    
+    async def _run_consumer(self, consumer):
+        stop = asyncio.ensure_future(self._stop.wait())
+        try:
+            while not self._stop.is_set():
+                get = asyncio.ensure_future(consumer._queue.get())
+                await asyncio.wait({get, stop}, return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    return
+                items = [get.result()]
+                # Собираем события, пришедшие следом, и обрабатываем их одной пачкой
+                if consumer.batch_window and await self._sleep(consumer.batch_window):
+                    return
+                items.extend(consumer.drain())
+                
+                started = time.monotonic()
+                consumer.running = True
+                try:
+                    await self._call(consumer.handler, items)
+                    consumer.batches += 1
+                except Exception as e:
+                    consumer.failures += 1
+                    CYCLE_FAILURES.inc(agent=consumer.name)
+                    print(f"❌ Event handler '{consumer.name}' failed: {e}")
+                finally:
+                    consumer.running = False
+                    CYCLE_DURATION.observe(time.monotonic() - started, agent=consumer.name)
+        finally:
+            stop.cancel()
+    
+    async def _heartbeat(self):
+        while not await self._sleep(self.heartbeat_interval):
+            uptime = int(time.monotonic() - self._started_at)
+            busy = [worker.name for worker in self.jobs + self.consumers if worker.running]
+            status = f", running: {', '.join(busy)}" if busy else ""
+            print(f"⏰ All agents running... ({uptime // 60}m {uptime % 60}s{status})")
+    
+    def stop(self):
+        """Остановить рантайм: новые запуски не начинаются, текущие дорабатывают"""
+        if self._stop is not None:
+            self._stop.set()
+    
+    async def run(self):
+        """Запустить все задачи и ждать остановки"""
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._started_at = time.monotonic()
+        # Каждой задаче и обработчику - свой поток: иначе долгие циклы задерживают
+        # короткие задачи (например, heartbeat воркера дольше TTL аренды)
+        workers = len(self.jobs) + len(self.consumers)
+        threads = max(self.max_threads, workers)
+        if threads > self.max_threads:
+            print(f"ℹ️  Runtime threads raised from {self.max_threads} to {threads} ({workers} jobs and consumers)")
+        # Свой пул, а не пул цикла по умолчанию: asyncio.run при выходе ждет
+        # завершения пула по умолчанию, а зависший вызов не должен держать остановку
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='agent')
+        
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        
+        tasks = [asyncio.create_task(self._run_job(job), name=job.name) for job in self.jobs]
+        for consumer in self.consumers:
+            consumer.bind(loop)
+            tasks.append(asyncio.create_task(self._run_consumer(consumer), name=consumer.name))
+        heartbeat = asyncio.create_task(self._heartbeat(), name='heartbeat')
+        try:
+            await self._stop.wait()
+        finally:
+            self._stop.set()
+            heartbeat.cancel()
+            # Даем текущим запускам завершиться, затем отменяем оставшиеся
+            _, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout) if tasks else (set(), set())
+            for task in pending:
+                print(f"⚠️  Job '{task.get_name()}' did not finish in {self.shutdown_timeout}s, cancelling")
+                task.cancel()
+            await asyncio.gather(heartbeat, *pending, return_exceptions=True)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            print("🛑 Agent runtime stopped")
@@ -0,0 +1,185 @@
+import os
+import time
+import socket
+import sqlite3
+import hashlib
+import threading
+
+def default_worker_id():
+    """Идентификатор воркера по умолчанию: хост (в Docker - id контейнера) и pid"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _score(worker_id, key):
+    digest = hashlib.sha256(f"{worker_id}:{key}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+def rendezvous_owner(key, workers):
+    """Владелец ключа по rendezvous-хешированию: при уходе воркера переезжают только его ключи"""
+    return max(workers, key=lambda worker_id: _score(worker_id, key)) if workers else None
+
+class ShardCoordinator:
+    """Владение задачами при одном воркере: все ключи свои, аренды не нужны"""
+    
+    def __init__(self, worker_id=None):
+        self.worker_id = worker_id or default_worker_id()
+        self._listeners = []
+    
+    def on_rebalance(self, callback):
+        """Вызывать callback() при смене состава воркеров (ключи переходят между ними)"""
+        self._listeners.append(callback)
+    
+    def _rebalanced(self):
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️  Rebalance handler failed: {e}")
+    
+    def owns(self, key):
+        """Отвечает ли этот воркер за ключ (без обращения к хранилищу)"""
+        return True
+    
+    def acquire(self, keys):
+        """Взять аренду ключей перед обработкой, вернуть взятые"""
+        return list(keys)
+    
+    def release(self, keys):
+        """Освободить аренду ключей после обработки"""
+    
+    def claim(self, keys):
+        """Ключи, которые этот воркер может обработать сейчас: свои и не занятые другими"""
+        return set(self.acquire([key for key in keys if self.owns(key)]))
+    
+    def heartbeat(self):
+        """Отметить, что воркер жив, продлить его аренды, обновить список воркеров"""
+    
+    def leave(self):
+        """Выйти из группы при остановке: ключи сразу переходят к остальным"""
+    
+    def members(self):
+        return [self.worker_id]
+
+class SQLiteShardCoordinator(ShardCoordinator):
+    """Распределение задач между воркерами одного хоста через общий файл SQLite.
+    
+    Воркеры отмечаются в таблице workers; живые - те, чей heartbeat не старше
+    lease_ttl. Ключ принадлежит живому воркеру с максимальным rendezvous-весом,
+    поэтому при падении воркера его задачи расходятся по оставшимся, а при
+    добавлении нового к нему переезжает лишь его доля. На время обработки ключ
+    дополнительно закрепляется арендой в таблице leases - это исключает двойную
+    обработку в момент перебалансировки. Аренды продлеваются heartbeat'ом и
+    истекают сами, если воркер умер.
+    """
+    
+    def __init__(self, db_path, worker_id=None, lease_ttl=60):
+        super().__init__(worker_id)
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.lease_ttl = lease_ttl
+        self._lock = threading.Lock()
+        self._members = [self.worker_id]
+        # Несколько процессов пишут в один файл - ждем блокировку, а не падаем
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        self.heartbeat()
+    
+    def owns(self, key):
+        with self._lock:
+            members = self._members
+        return rendezvous_owner(key, members) == self.worker_id
+    
+    def acquire(self, keys):
+        now = time.time()
+        acquired = []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key in keys:
+                    row = self._conn.execute(
+                        'SELECT owner, expires_at FROM leases WHERE key = ?', (key,)
+                    ).fetchone()
+                    if row and row[0] != self.worker_id and row[1] > now:
+                        continue
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)',
+                        (key, self.worker_id, now + self.lease_ttl)
+                    )
+                    acquired.append(key)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return acquired
+    
+    def release(self, keys):
+        keys = list(keys)
+        if not keys:
+            return
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM leases WHERE key = ? AND owner = ?',
+                [(key, self.worker_id) for key in keys]
+            )
+    
+    def heartbeat(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)',
+                    (self.worker_id, now)
+                )
+                self._conn.execute(
+                    'UPDATE leases SET expires_at = ? WHERE owner = ?',
+                    (now + self.lease_ttl, self.worker_id)
+                )
+                # Умершие воркеры и их аренды больше никому не мешают
+                self._conn.execute('DELETE FROM workers WHERE heartbeat_at <= ?', (now - self.lease_ttl,))
+                self._conn.execute('DELETE FROM leases WHERE expires_at <= ?', (now,))
+                members = sorted(row[0] for row in self._conn.execute('SELECT worker_id FROM workers'))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            
+            changed = members != self._members
+            if changed:
+                print(f"🧩 Workers: {len(members)} ({', '.join(members)})")
+            self._members = members
+        
+        if changed:
+            self._rebalanced()
+    
+    def leave(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM workers WHERE worker_id = ?', (self.worker_id,))
+            self._conn.execute('DELETE FROM leases WHERE owner = ?', (self.worker_id,))
+            self._conn.close()
+    
+    def members(self):
+        with self._lock:
+            return list(self._members)
+
+def create_shard_coordinator(backend, state_dir, worker_id=None, lease_ttl=60):
+    """Создать координатор воркеров по имени бэкенда (none или sqlite)"""
+    if backend in (None, '', 'none'):
+        return ShardCoordinator(worker_id)
+    if backend == 'sqlite':
+        return SQLiteShardCoordinator(os.path.join(state_dir, 'workers.db'), worker_id, lease_ttl)
+    raise ValueError(f"Unknown sharding backend: {backend}")
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+def fingerprint(*values):
+    """Отпечаток набора значений (стабильный sha256 от JSON)"""
+    payload = json.dumps(values, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class StateStore:
+    """Базовое хранилище состояния агентов: namespace/key -> отпечаток и данные"""
+    
+    def get(self, namespace, key):
+        """Получить запись или None (просроченные записи не возвращаются)"""
+        raise NotImplementedError
+    
+    def put(self, namespace, key, fingerprint, data=None, ttl=None):
+        """Сохранить запись; ttl в секундах, None - без срока"""
+        raise NotImplementedError
+    
+    def delete(self, namespace, key):
+        """Удалить запись"""
+        raise NotImplementedError
+    
+    def purge_expired(self):
+        """Удалить просроченные записи, вернуть их количество"""
+        raise NotImplementedError
+    
+    def is_current(self, namespace, key, fingerprint):
+        """Есть ли актуальная запись с тем же отпечатком"""
+        entry = self.get(namespace, key)
+        return entry is not None and entry['fingerprint'] == fingerprint
+    
+    def close(self):
+        """Закрыть хранилище"""
+
+class MemoryStateStore(StateStore):
+    """Хранилище в памяти (состояние теряется при перезапуске)"""
+    
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return None
+            if entry['expires_at'] is not None and entry['expires_at'] <= time.time():
+                del self._entries[(namespace, key)]
+                return None
+            return dict(entry)
+    
+    def put(self, namespace, key, fingerprint, data=None, ttl=None):
+        now = time.time()
+        with self._lock:
+            self._entries[(namespace, key)] = {
+                'fingerprint': fingerprint,
+                'data': data,
+                'updated_at': now,
+                'expires_at': now + ttl if ttl else None
+            }
+    
+    def delete(self, namespace, key):
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+    
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                k for k, entry in self._entries.items()
+                if entry['expires_at'] is not None and entry['expires_at'] <= now
+            ]
+            for k in expired:
+                del self._entries[k]
+        return len(expired)
+
+class SQLiteStateStore(StateStore):
+    """Хранилище в SQLite (переживает перезапуск контейнера)"""
+    
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS agent_state (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                data TEXT,
+                updated_at REAL NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            )
+        ''')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_agent_state_expires ON agent_state (expires_at)'
+        )
+    
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT fingerprint, data, updated_at, expires_at FROM agent_state '
+                'WHERE namespace = ? AND key = ?',
+                (namespace, key)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[3] is not None and row[3] <= time.time():
+            return None
+        return {
+            'fingerprint': row[0],
+            'data': json.loads(row[1]) if row[1] is not None else None,
+            'updated_at': row[2],
+            'expires_at': row[3]
+        }
+    
+    def put(self, namespace, key, fingerprint, data=None, ttl=None):
+        now = time.time()
+        payload = json.dumps(data, ensure_ascii=False) if data is not None else None
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO agent_state '
+                '(namespace, key, fingerprint, data, updated_at, expires_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (namespace, key, fingerprint, payload, now, now + ttl if ttl else None)
+            )
+    
+    def delete(self, namespace, key):
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM agent_state WHERE namespace = ? AND key = ?',
+                (namespace, key)
+            )
+    
+    def purge_expired(self):
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM agent_state WHERE expires_at IS NOT NULL AND expires_at <= ?',
+                (time.time(),)
+            )
+            return cursor.rowcount
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_state_store(backend, state_dir):
+    """Создать хранилище состояния по имени бэкенда (sqlite или memory)"""
+    if backend == 'memory':
+        return MemoryStateStore()
+    if backend == 'sqlite':
+        return SQLiteStateStore(os.path.join(state_dir, 'agent_state.db'))
+    raise ValueError(f"Unknown state store backend: {backend}")
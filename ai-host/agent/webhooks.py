@@ -0,0 +1,163 @@
+import hmac
+import json
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import REGISTRY
+from jira_client import is_issue_key
+
+WEBHOOK_EVENTS = REGISTRY.counter(
+    'agent_webhook_events_total', 'Webhook events received', ('source', 'event', 'result'))
+
+JIRA_ISSUE_EVENTS = ('jira:issue_created', 'jira:issue_updated', 'comment_created', 'comment_updated')
+
+@dataclass
+class WorkItem:
+    """Единица работы из события: задача Jira или push в репозиторий"""
+    kind: str           # 'jira_issue' или 'gitea_push'
+    key: str            # ключ задачи или ветка
+    status: str = None  # статус задачи из события, если известен
+    data: dict = field(default_factory=dict)
+
+def parse_jira_event(payload):
+    """Событие Jira -> WorkItem или None, если событие нам не интересно"""
+    event = payload.get('webhookEvent', '')
+    issue = payload.get('issue') or {}
+    # Ключ попадает в JQL - принимаем только ключи вида AL-12
+    if event not in JIRA_ISSUE_EVENTS or not is_issue_key(issue.get('key')):
+        return None
+    status = ((issue.get('fields') or {}).get('status') or {}).get('name')
+    return WorkItem(kind='jira_issue', key=issue['key'], status=status, data={'event': event})
+
+def parse_gitea_push(payload):
+    """Push-событие Gitea -> WorkItem с веткой, новым head и репозиторием"""
+    ref = payload.get('ref', '')
+    if not ref.startswith('refs/heads/') or not payload.get('after'):
+        return None
+    repo = (payload.get('repository') or {}).get('full_name')
+    return WorkItem(kind='gitea_push', key=ref[len('refs/heads/'):], data={'head': payload['after'], 'repo': repo})
+
+def _signature_valid(secret, body, signature):
+    """Проверка HMAC-SHA256 подписи тела (формат "sha256=<hex>" или просто hex)"""
+    if not signature:
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.split('=', 1)[-1].strip())
+
+class WebhookReceiver:
+    """Встроенный приемник вебхуков Jira и Gitea.
+    
+    POST /webhooks/jira  - события задач и комментариев Jira
+    POST /webhooks/gitea - push-события Gitea
+    События превращаются в WorkItem и передаются в dispatch; ответ 202 отдается сразу,
+    сама работа выполняется агентами асинхронно.
+    """
+    
+    # Вебхуки Jira и Gitea - единицы килобайт; тело больше лимита не читаем
+    MAX_BODY = 1024 * 1024
+    
+    def __init__(self, dispatch, host='127.0.0.1', port=8085, jira_secret=None, gitea_secret=None,
+                 max_body=MAX_BODY):
+        self.dispatch = dispatch
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.jira_secret = jira_secret
+        self.gitea_secret = gitea_secret
+        self._server = None
+    
+    def _authorized_jira(self, headers, query, body):
+        if not self.jira_secret:
+            return True
+        # Jira подписывает тело при заданном секрете; для старых версий - токен в URL вебхука
+        signature = headers.get('X-Hub-Signature')
+        if signature:
+            return _signature_valid(self.jira_secret, body, signature)
+        return hmac.compare_digest(query.get('token', ''), self.jira_secret)
+    
+    def _authorized_gitea(self, headers, body):
+        if not self.gitea_secret:
+            return True
+        return _signature_valid(self.gitea_secret, body, headers.get('X-Gitea-Signature'))
+    
+    def handle(self, path, headers, query, body):
+        """Разобрать запрос вебхука, вернуть HTTP-статус"""
+        if path == '/webhooks/jira':
+            source, authorized = 'jira', self._authorized_jira(headers, query, body)
+        elif path == '/webhooks/gitea':
+            source, authorized = 'gitea', self._authorized_gitea(headers, body)
+        else:
+            return 404
+        
+        if not authorized:
+            WEBHOOK_EVENTS.inc(source=source, event='unknown', result='unauthorized')
+            return 401
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            WEBHOOK_EVENTS.inc(source=source, event='unknown', result='bad_request')
+            return 400
+        
+        if source == 'jira':
+            event = payload.get('webhookEvent', 'unknown')
+            item = parse_jira_event(payload)
+        else:
+            event = headers.get('X-Gitea-Event', 'unknown')
+            item = parse_gitea_push(payload) if event == 'push' else None
+        
+        WEBHOOK_EVENTS.inc(source=source, event=event, result='accepted' if item else 'ignored')
+        if item:
+            self.dispatch(item)
+        return 202
+    
+    def start(self):
+        """Запустить приемник в фоновом потоке"""
+        receiver = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0 or length > receiver.max_body:
+                    # Тело не читаем - соединение закрываем, чтобы не разбирать его остаток
+                    self.close_connection = True
+                    self._reply(400 if length < 0 else 413)
+                    return
+                body = self.rfile.read(length) if length else b''
+                try:
+                    status = receiver.handle(parsed.path, self.headers, query, body)
+                except Exception as e:
+                    print(f"❌ Webhook handling error: {e}")
+                    status = 500
+                self._reply(status)
+            
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            
+            def do_GET(self):
+                # Проверка доступности приемника
+                self.send_response(200 if self.path == '/healthz' else 404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='webhooks', daemon=True).start()
+        print(f"🪝 Webhook receiver: http://{self.host}:{self._server.server_port}/webhooks/{{jira,gitea}}")
+        return self
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
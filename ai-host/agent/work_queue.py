@@ -0,0 +1,230 @@
+import heapq
+import time
+import itertools
+import threading
+from datetime import datetime
+from metrics import REGISTRY, QUEUE_DEPTH
+
+WORK_QUEUE_EVENTS = REGISTRY.counter(
+    'agent_work_queue_events_total', 'Work queue operations by outcome', ('queue', 'result'))
+
+# Уровни приоритета: меньше - раньше
+PRIORITY_EVENT = 0   # задача пришла событием (вебхук) - ее только что изменили
+PRIORITY_POLL = 1    # задача найдена опросом
+PRIORITY_RETRY = 2   # повтор после ошибки
+
+def issue_priority(issue, level=PRIORITY_POLL):
+    """Приоритет задачи Jira: сначала уровень, затем недавно обновленные"""
+    updated = (issue.get('fields') or {}).get('updated')
+    try:
+        age_key = -datetime.strptime(updated, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+    except (TypeError, ValueError):
+        age_key = 0
+    return (level, age_key)
+
+class _Entry:
+    __slots__ = ('key', 'item', 'priority', 'ready_at', 'attempts', 'seq')
+    
+    def __init__(self, key, item, priority, ready_at, attempts=0):
+        self.key = key
+        self.item = item
+        self.priority = priority
+        self.ready_at = ready_at
+        self.attempts = attempts
+        self.seq = None
+
+class WorkQueue:
+    """Очередь работы агента с дедупликацией по ключу задачи.
+    
+    - один ключ в очереди не более одного раза: повторная постановка обновляет
+      данные задачи и повышает приоритет, а не создает дубль;
+    - ключ, уже взятый в работу, не выдается второй раз, пока не вызван done()
+      или retry(); пришедшее за это время обновление ставится после завершения;
+    - retry() откладывает задачу на delay секунд, после max_attempts попыток задача снимается;
+    - емкость ограничена: при заполнении put() ждет место (block=True) или возвращает False.
+      Повторы в емкость не входят: их ключи уже были приняты, а освободить место
+      до истечения задержки они не могут - иначе очередь из одних повторов
+      блокировала бы постановку новых задач.
+    """
+    
+    def __init__(self, name, capacity=1000, max_attempts=3, retry_delay=60):
+        self.name = name
+        self.capacity = capacity
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._entries = {}       # ключ -> _Entry, ожидающие в очереди
+        self._in_flight = set()  # ключи, выданные в работу
+        self._updated = {}       # ключ в работе -> обновление, пришедшее во время работы
+        self._retrying = set()   # ожидающие ключи, поставленные retry() (вне емкости)
+        self._ready = []         # куча (priority, seq, key)
+        self._delayed = []       # куча (ready_at, seq, key)
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+    
+    def __len__(self):
+        with self._cond:
+            return len(self._entries) + len(self._updated)
+    
+    def _occupied(self):
+        """Сколько мест емкости занято"""
+        return len(self._entries) - len(self._retrying) + len(self._updated)
+    
+    def _count(self, result):
+        WORK_QUEUE_EVENTS.inc(queue=self.name, result=result)
+    
+    def _depth_changed(self):
+        QUEUE_DEPTH.set(len(self._entries) + len(self._updated), agent=self.name)
+    
+    def _push(self, entry):
+        entry.seq = next(self._counter)
+        self._entries[entry.key] = entry
+        if entry.ready_at > time.monotonic():
+            heapq.heappush(self._delayed, (entry.ready_at, entry.seq, entry.key))
+        else:
+            heapq.heappush(self._ready, (entry.priority, entry.seq, entry.key))
+    
+    def _merge(self, current, entry):
+        """Слить повторную постановку ключа с уже ожидающей записью"""
+        current.item = entry.item if entry.item is not None else current.item
+        current.priority = min(current.priority, entry.priority)
+        current.ready_at = min(current.ready_at, entry.ready_at)
+        current.attempts = max(current.attempts, entry.attempts)
+        # Старые позиции в кучах станут недействительными по seq
+        self._push(current)
+    
+    def put(self, key, item=None, priority=(PRIORITY_POLL,), delay=0, block=False, timeout=None):
+        """Поставить задачу в очередь; False - очередь заполнена"""
+        entry = _Entry(key, item, priority, time.monotonic() + delay)
+        with self._cond:
+            if key in self._in_flight:
+                current = self._updated.get(key)
+                if current:
+                    current.item = item if item is not None else current.item
+                    current.priority = min(current.priority, priority)
+                    self._count('coalesced')
+                else:
+                    self._updated[key] = entry
+                    self._count('deferred')
+                self._depth_changed()
+                return True
+            
+            current = self._entries.get(key)
+            if current:
+                self._merge(current, entry)
+                self._count('coalesced')
+                return True
+            
+            # Противодавление: новым ключам нужно свободное место
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._occupied() >= self.capacity:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    self._count('rejected')
+                    return False
+                self._cond.wait(remaining)
+            
+            self._push(entry)
+            self._count('enqueued')
+            self._depth_changed()
+            self._cond.notify_all()
+            return True
+    
+    def _promote_due(self):
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, seq, key = heapq.heappop(self._delayed)
+            entry = self._entries.get(key)
+            if entry and entry.seq == seq:
+                heapq.heappush(self._ready, (entry.priority, seq, key))
+    
+    def _next_due(self):
+        """Через сколько секунд созреет ближайшая отложенная задача"""
+        while self._delayed:
+            ready_at, seq, key = self._delayed[0]
+            entry = self._entries.get(key)
+            if entry and entry.seq == seq:
+                return max(0.0, ready_at - time.monotonic())
+            heapq.heappop(self._delayed)
+        return None
+    
+    def get_batch(self, max_items=50, timeout=0):
+        """Взять в работу до max_items готовых задач: список (key, item, attempts).
+        
+        timeout - сколько ждать хотя бы одну задачу (0 - не ждать, None - без ограничения).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._promote_due()
+                batch = []
+                while self._ready and len(batch) < max_items:
+                    _, seq, key = heapq.heappop(self._ready)
+                    entry = self._entries.get(key)
+                    if entry is None or entry.seq != seq:
+                        continue
+                    del self._entries[key]
+                    self._retrying.discard(key)
+                    self._in_flight.add(key)
+                    batch.append((key, entry.item, entry.attempts))
+                if batch:
+                    self._depth_changed()
+                    self._cond.notify_all()
+                    return batch
+                
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                due = self._next_due()
+                waits = [w for w in (remaining, due) if w is not None]
+                self._cond.wait(min(waits) if waits else None)
+    
+    def _finish(self, key):
+        """Снять ключ с работы; обновление, пришедшее во время работы, вернуть в очередь"""
+        self._in_flight.discard(key)
+        update = self._updated.pop(key, None)
+        if update:
+            self._push(update)
+        self._depth_changed()
+        self._cond.notify_all()
+        return update
+    
+    def done(self, key):
+        """Задача обработана"""
+        with self._cond:
+            if key in self._in_flight:
+                self._finish(key)
+    
+    def retry(self, key, item, attempts=0, delay=None):
+        """Отложить повтор задачи; False - попытки исчерпаны, задача снята с очереди"""
+        with self._cond:
+            if key not in self._in_flight:
+                return False
+            update = self._finish(key)
+            if update:
+                # Задачу уже изменили - новая версия обработается без задержки
+                self._count('coalesced')
+                return True
+            if attempts + 1 >= self.max_attempts:
+                self._count('dropped')
+                return False
+            delay = self.retry_delay * (2 ** attempts) if delay is None else delay
+            self._push(_Entry(key, item, (PRIORITY_RETRY,), time.monotonic() + delay, attempts + 1))
+            self._retrying.add(key)
+            self._count('retried')
+            self._depth_changed()
+            return True
+    
+    def has_pending(self, keys):
+        """Остался ли хоть один из ключей в очереди, в работе или на повторе"""
+        with self._cond:
+            return any(key in self._entries or key in self._in_flight or key in self._updated
+                       for key in keys)
+    
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._entries),
+                'in_flight': len(self._in_flight),
+                'updated_in_flight': len(self._updated),
+                'delayed': sum(1 for e in self._entries.values() if e.ready_at > time.monotonic())
+            }